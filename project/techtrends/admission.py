@@ -0,0 +1,83 @@
+import threading
+import time
+
+
+# Raised when a request is rejected by an `AdmissionLimiter`
+class Overloaded(Exception):
+    pass
+
+
+# Admission control of the requests of one budget, e.g. the reads.
+# At most `limit` requests run at once; up to `queue_size` more wait, for at
+# most `queue_timeout` seconds, for a running request to finish, and the
+# others are rejected right away. The limit adapts to the observed latency:
+# it is cut by `backoff` when a request takes longer than `target_latency`,
+# at most once per `target_latency`, and grows back by one for every `limit`
+# requests served in time, up to `max_limit`.
+class AdmissionLimiter:
+    def __init__(self, max_limit, queue_size, queue_timeout=1.0, target_latency=0.25,
+                 min_limit=1, backoff=0.9):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.limit = float(max_limit)
+        self._in_flight = 0
+        self._waiting = 0
+        self._last_backoff = 0.0
+        self._condition = threading.Condition()
+        self.admitted = 0
+        self.rejected = 0
+
+    # Number of requests allowed to run at once
+    def _capacity(self):
+        return max(self.min_limit, int(self.limit))
+
+    # Admit a request, waiting in the queue if the limit is reached.
+    # Returns the admission time, to give back to `release`.
+    def acquire(self):
+        with self._condition:
+            if self._in_flight >= self._capacity():
+                if self._waiting >= self.queue_size:
+                    self.rejected += 1
+                    raise Overloaded('admission queue full')
+                deadline = time.monotonic() + self.queue_timeout
+                self._waiting += 1
+                try:
+                    while self._in_flight >= self._capacity():
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            raise Overloaded('no admission after %.1fs' % self.queue_timeout)
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_flight += 1
+            self.admitted += 1
+        return time.monotonic()
+
+    # Record the end of a request admitted at `start` and adapt the limit
+    def release(self, start):
+        now = time.monotonic()
+        with self._condition:
+            self._in_flight -= 1
+            if now - start > self.target_latency:
+                if now - self._last_backoff >= self.target_latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_backoff = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'limit': self._capacity(),
+                'max_limit': self.max_limit,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
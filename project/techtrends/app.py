@@ -1,49 +1,794 @@
+import atexit
+import base64
+import hmac
+import logging
+import mimetypes
+import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import TimeoutError as WriteTimeout
 
-from flask import Flask, jsonify, json, render_template, request, url_for, redirect, flash
-from werkzeug.exceptions import abort
+from flask import Flask, Response, has_request_context, jsonify, json, make_response, render_template, request, url_for, redirect, flash, g, send_from_directory, stream_with_context
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup, escape
+from werkzeug.exceptions import NotFound, abort
+
+from cache import IdUpperBound, LRUCache, MISSING, SingleFlight
+from compression import (EXTENSIONS, available_encodings, choose_encoding, compress,
+                         file_hash, is_compressible)
+from conditional import (folder_version, is_not_modified, make_etag,
+                         not_modified_response, parse_timestamp, set_cache_headers)
+from admission import AdmissionLimiter, Overloaded
+from db import (ConnectionPool, DEFAULT_PRAGMAS, GroupCommitWriter, PoolTimeout, QueryStats,
+                WriteBehindCounter)
+from health import LagMonitor
+from logs import parse_rates, setup_logging
+from metrics import CONTENT_TYPE, Registry
+from profiling import Profiler, TimedTemplate, add_db_time
+
+# Define the Flask application
+app = Flask(__name__)
+app.config['SECRET_KEY'] = 'your secret key'
+app.config['DATABASE'] = os.environ.get('TECHTRENDS_DATABASE', 'database.db')
+app.config['DB_POOL_SIZE'] = int(os.environ.get('TECHTRENDS_DB_POOL_SIZE', '8'))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('TECHTRENDS_DB_POOL_TIMEOUT', '5'))
+app.config['DB_PRAGMAS'] = tuple(
+    (name, os.environ.get('TECHTRENDS_DB_' + name.upper(), value))
+    for name, value in DEFAULT_PRAGMAS)
+app.config['DB_GROUP_COMMIT'] = os.environ.get('TECHTRENDS_DB_GROUP_COMMIT', '0') == '1'
+app.config['DB_GROUP_COMMIT_DELAY'] = float(os.environ.get('TECHTRENDS_DB_GROUP_COMMIT_DELAY', '0.002'))
+# A batch of the writer waits for the database lock for up to `busy_timeout`
+# and may queue behind another batch: waiting longer than both, a request
+# learns whether its post was committed rather than giving up on a post that
+# is committed afterwards, which a retry would duplicate
+app.config['DB_WRITE_TIMEOUT'] = float(os.environ.get(
+    'TECHTRENDS_DB_WRITE_TIMEOUT',
+    2 * (int(dict(app.config['DB_PRAGMAS'])['busy_timeout']) / 1000.0
+         + app.config['DB_GROUP_COMMIT_DELAY']) + 1))
+app.config['POSTS_PER_PAGE'] = int(os.environ.get('TECHTRENDS_POSTS_PER_PAGE', '20'))
+app.config['MAX_POSTS_PER_PAGE'] = int(os.environ.get('TECHTRENDS_MAX_POSTS_PER_PAGE', '100'))
+app.config['POST_CACHE_SIZE'] = int(os.environ.get('TECHTRENDS_POST_CACHE_SIZE', '1024'))
+app.config['INDEX_CACHE_SIZE'] = int(os.environ.get('TECHTRENDS_INDEX_CACHE_SIZE', '128'))
+app.config['STREAM_INDEX'] = os.environ.get('TECHTRENDS_STREAM_INDEX', '0') == '1'
+app.config['STREAM_MAX_POSTS_PER_PAGE'] = int(os.environ.get('TECHTRENDS_STREAM_MAX_POSTS_PER_PAGE', '10000'))
+app.config['STREAM_BUFFER_POSTS'] = int(os.environ.get('TECHTRENDS_STREAM_BUFFER_POSTS', '50'))
+app.config['PAGE_CACHE_TTL'] = float(os.environ.get('TECHTRENDS_PAGE_CACHE_TTL', '60'))
+app.config['INDEX_MAX_AGE'] = int(os.environ.get('TECHTRENDS_INDEX_MAX_AGE', '10'))
+app.config['POST_MAX_AGE'] = int(os.environ.get('TECHTRENDS_POST_MAX_AGE', '3600'))
+app.config['ABOUT_MAX_AGE'] = int(os.environ.get('TECHTRENDS_ABOUT_MAX_AGE', '3600'))
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('TECHTRENDS_COMPRESS_MIN_SIZE', '500'))
+app.config['COMPRESSED_CACHE_SIZE'] = int(os.environ.get('TECHTRENDS_COMPRESSED_CACHE_SIZE', '1024'))
+app.config['STATIC_MAX_AGE'] = int(os.environ.get('TECHTRENDS_STATIC_MAX_AGE', '31536000'))
+app.config['STATIC_UNVERSIONED_MAX_AGE'] = int(os.environ.get('TECHTRENDS_STATIC_UNVERSIONED_MAX_AGE', '60'))
+app.config['API_MAX_IDS'] = int(os.environ.get('TECHTRENDS_API_MAX_IDS', '100'))
+app.config['API_MAX_BULK_POSTS'] = int(os.environ.get('TECHTRENDS_API_MAX_BULK_POSTS', '10000'))
+app.config['ADMIN_TOKEN'] = os.environ.get('TECHTRENDS_ADMIN_TOKEN', '')
+app.config['PROFILING_ENABLED'] = os.environ.get('TECHTRENDS_PROFILING_ENABLED', '0') == '1'
+app.config['PROFILING_SAMPLE_RATE'] = float(os.environ.get('TECHTRENDS_PROFILING_SAMPLE_RATE', '0.01'))
+app.config['PROFILING_DIR'] = os.environ.get('TECHTRENDS_PROFILING_DIR') or None
+app.config['PROFILING_KEEP'] = int(os.environ.get('TECHTRENDS_PROFILING_KEEP', '100'))
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('TECHTRENDS_SLOW_QUERY_MS', '50'))
+app.config['MISSING_POST_CACHE_SIZE'] = int(os.environ.get('TECHTRENDS_MISSING_POST_CACHE_SIZE', '4096'))
+app.config['MISSING_POST_CACHE_TTL'] = float(os.environ.get('TECHTRENDS_MISSING_POST_CACHE_TTL', '10'))
+app.config['POST_ID_REFRESH_INTERVAL'] = float(os.environ.get('TECHTRENDS_POST_ID_REFRESH_INTERVAL', '1'))
+app.config['POST_COALESCE_TIMEOUT'] = float(os.environ.get('TECHTRENDS_POST_COALESCE_TIMEOUT', '2'))
+app.config['VIEW_COUNTS'] = os.environ.get('TECHTRENDS_VIEW_COUNTS', '1') == '1'
+app.config['VIEW_FLUSH_INTERVAL'] = float(os.environ.get('TECHTRENDS_VIEW_FLUSH_INTERVAL', '5'))
+app.config['VIEW_MAX_PENDING'] = int(os.environ.get('TECHTRENDS_VIEW_MAX_PENDING', '10000'))
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TECHTRENDS_TEMPLATE_CACHE_DIR')
+app.config['WARM_UP'] = os.environ.get('TECHTRENDS_WARM_UP', '1') == '1'
+app.config['READY_MAX_IN_FLIGHT'] = int(os.environ.get('TECHTRENDS_READY_MAX_IN_FLIGHT', '64'))
+app.config['READY_MAX_POOL_USAGE'] = float(os.environ.get('TECHTRENDS_READY_MAX_POOL_USAGE', '1'))
+app.config['READY_MAX_LAG_MS'] = float(os.environ.get('TECHTRENDS_READY_MAX_LAG_MS', '500'))
+app.config['READY_DB_TIMEOUT'] = float(os.environ.get('TECHTRENDS_READY_DB_TIMEOUT', '0.5'))
+app.config['ADMISSION_ENABLED'] = os.environ.get('TECHTRENDS_ADMISSION_ENABLED', '1') == '1'
+# A read holds a pooled connection: by default no more reads run than there
+# are connections, and the next ones wait in the admission queue rather than
+# for a connection
+app.config['ADMISSION_READ_LIMIT'] = int(os.environ.get('TECHTRENDS_ADMISSION_READ_LIMIT',
+                                                        app.config['DB_POOL_SIZE']))
+app.config['ADMISSION_READ_QUEUE'] = int(os.environ.get('TECHTRENDS_ADMISSION_READ_QUEUE', '64'))
+app.config['ADMISSION_READ_TARGET_MS'] = float(os.environ.get('TECHTRENDS_ADMISSION_READ_TARGET_MS', '250'))
+app.config['ADMISSION_WRITE_LIMIT'] = int(os.environ.get('TECHTRENDS_ADMISSION_WRITE_LIMIT', '4'))
+app.config['ADMISSION_WRITE_QUEUE'] = int(os.environ.get('TECHTRENDS_ADMISSION_WRITE_QUEUE', '16'))
+app.config['ADMISSION_WRITE_TARGET_MS'] = float(os.environ.get('TECHTRENDS_ADMISSION_WRITE_TARGET_MS', '500'))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('TECHTRENDS_ADMISSION_QUEUE_TIMEOUT', '1'))
+app.config['ADMISSION_RETRY_AFTER'] = int(os.environ.get('TECHTRENDS_ADMISSION_RETRY_AFTER', '1'))
+app.config['LOG_FILE'] = os.environ.get('TECHTRENDS_LOG_FILE', '')
+app.config['LOG_LEVEL'] = os.environ.get('TECHTRENDS_LOG_LEVEL', 'INFO').upper()
+app.config['LOG_ACCESS'] = os.environ.get('TECHTRENDS_LOG_ACCESS', '1') == '1'
+app.config['LOG_SAMPLE_RATES'] = parse_rates(os.environ.get(
+    'TECHTRENDS_LOG_SAMPLE_RATES', '/healthz=0.01,/readyz=0.01,/metrics=0.1'))
+app.config['LOG_QUEUE_SIZE'] = int(os.environ.get('TECHTRENDS_LOG_QUEUE_SIZE', '10000'))
+app.config['LOG_BATCH_SIZE'] = int(os.environ.get('TECHTRENDS_LOG_BATCH_SIZE', '512'))
+app.config['LOG_FLUSH_INTERVAL'] = float(os.environ.get('TECHTRENDS_LOG_FLUSH_INTERVAL', '1'))
+
+# Function to get the fields of the current request added to every log record
+def log_context():
+    if not has_request_context():
+        return None
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    return {'method': request.method, 'route': route}
+
+# Log records are written as JSON lines by a background thread, so that
+# logging never does I/O on a request thread
+log_handler = setup_logging(app.config['LOG_FILE'] or None,
+                            level=app.config['LOG_LEVEL'],
+                            context=log_context,
+                            sample_rates=app.config['LOG_SAMPLE_RATES'],
+                            max_queue=app.config['LOG_QUEUE_SIZE'],
+                            batch_size=app.config['LOG_BATCH_SIZE'],
+                            flush_interval=app.config['LOG_FLUSH_INTERVAL'])
+access_logger = logging.getLogger('techtrends.access')
+
+# Templates report their rendering time to the profiler
+app.jinja_env.template_class = TimedTemplate
+
+# Compiled templates are kept on disk, so that the workers, and the pods
+# sharing the folder, load their bytecode instead of compiling them again
+# Without a configured folder, Jinja creates one in the temporary directory
+# that only the current user may write to, as another user could otherwise
+# plant bytecode there
+if app.config['TEMPLATE_CACHE_DIR'] is None:
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+elif app.config['TEMPLATE_CACHE_DIR']:
+    os.makedirs(app.config['TEMPLATE_CACHE_DIR'], mode=0o700, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+# Profiler of a sample of the requests, toggled through `/admin/profiling`
+profiler = Profiler(app.config['PROFILING_DIR'],
+                    enabled=app.config['PROFILING_ENABLED'],
+                    sample_rate=app.config['PROFILING_SAMPLE_RATE'],
+                    keep=app.config['PROFILING_KEEP'])
+
+# Metrics exposed on the `/metrics` endpoint
+registry = Registry()
+request_count = registry.counter(
+    'techtrends_requests_total', 'Number of HTTP requests served.',
+    ('method', 'route', 'status'))
+request_latency = registry.histogram(
+    'techtrends_request_duration_seconds', 'Time spent handling HTTP requests.',
+    ('method', 'route'))
+requests_in_flight = registry.gauge(
+    'techtrends_requests_in_flight', 'Number of HTTP requests being handled.')
+db_query_latency = registry.histogram(
+    'techtrends_db_query_duration_seconds', 'Time spent executing SQL statements.',
+    ('statement',))
+
+# Timing statistics of the SQL statements and log of the slow ones,
+# exposed on the `/admin/queries` endpoint
+query_stats = QueryStats(slow_threshold=app.config['SLOW_QUERY_MS'] / 1000.0)
+
+# Function to record the duration of a SQL statement
+def observe_query(connection, sql, parameters, seconds):
+    statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+    db_query_latency.observe(seconds, (statement,))
+    query_stats.observe(connection, sql, parameters, seconds)
+    add_db_time(seconds)
+
+# Pool of database connections shared by all the requests of this process
+pool = ConnectionPool(app.config['DATABASE'],
+                      max_size=app.config['DB_POOL_SIZE'],
+                      timeout=app.config['DB_POOL_TIMEOUT'],
+                      observer=observe_query,
+                      pragmas=app.config['DB_PRAGMAS'])
+
+# Optional writer coalescing the inserts of concurrent requests
+writer = None
+if app.config['DB_GROUP_COMMIT']:
+    writer = GroupCommitWriter(pool.connect, max_delay=app.config['DB_GROUP_COMMIT_DELAY'])
+registry.gauge('techtrends_db_connections', 'Number of pooled database connections.',
+               ('state',),
+               function=lambda: {(state,): value for state, value in pool.stats().items()
+                                 if state != 'max_size'})
+registry.gauge('techtrends_db_pool_max_size', 'Maximum number of pooled database connections.',
+               function=lambda: pool.max_size)
+# Views of the posts, counted in memory and written behind to `post_views`.
+# The counts not written yet are written at exit
+post_views = WriteBehindCounter(
+    pool.connect,
+    'INSERT INTO post_views (post_id, views) VALUES (?, ?) '
+    'ON CONFLICT (post_id) DO UPDATE SET views = views + excluded.views',
+    interval=app.config['VIEW_FLUSH_INTERVAL'],
+    max_pending=app.config['VIEW_MAX_PENDING'])
+atexit.register(post_views.flush)
+registry.gauge('techtrends_post_views_pending_keys',
+               'Number of posts with views not written to the database yet.',
+               function=lambda: post_views.stats()['pending_keys'])
+registry.counter('techtrends_post_views_flush_failures_total',
+                 'Number of failed writes of the view counts.',
+                 function=lambda: post_views.failures)
+registry.counter('techtrends_log_records_dropped_total',
+                 'Number of log records dropped because the log queue was full.',
+                 function=lambda: log_handler.dropped)
+
+# Version of the templates and static files, part of the ETag of every page
+template_version = make_etag(folder_version(os.path.join(app.root_path, app.template_folder)),
+                             folder_version(app.static_folder))
+
+# Caches of rendered pages.
+# Posts never change once created, so their pages are cached until they are
+# evicted or expire. Listing pages are cached per content version, i.e. the
+# largest post ID, so a post created by any process makes them unreachable;
+# they are also dropped whenever this process creates a post.
+post_cache = LRUCache(max_size=app.config['POST_CACHE_SIZE'],
+                      ttl=app.config['PAGE_CACHE_TTL'])
+index_cache = LRUCache(max_size=app.config['INDEX_CACHE_SIZE'],
+                       ttl=app.config['PAGE_CACHE_TTL'])
+
+# Function to export the counters of the page caches
+def cache_counter(counter):
+    return lambda: {('post',): post_cache.stats()[counter],
+                    ('index',): index_cache.stats()[counter]}
+
+for counter in ('hits', 'misses', 'evictions', 'expirations'):
+    registry.counter('techtrends_page_cache_%s_total' % counter,
+                     'Number of page cache %s.' % counter, ('cache',),
+                     function=cache_counter(counter))
+
+# Start timing the request
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    requests_in_flight.inc()
+
+# Record the metrics of the request.
+# Routes are labelled by their rule, e.g. `/<int:post_id>`, so that the
+# number of label values stays bounded
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None and not request.environ.get('techtrends.warm_up'):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_latency.observe(time.perf_counter() - start, (request.method, route))
+        request_count.inc((request.method, route, str(response.status_code)))
+    return response
+
+# Log the request, with its status and duration
+@app.after_request
+def log_request(response):
+    start = g.get('request_start')
+    if (app.config['LOG_ACCESS'] and start is not None
+            and not request.environ.get('techtrends.warm_up')):
+        access_logger.info('%s %s %s', request.method, request.full_path.rstrip('?'),
+                           response.status_code,
+                           extra={'status': response.status_code,
+                                  'duration_ms': round((time.perf_counter() - start) * 1000, 3)})
+    return response
+
+# The in-flight gauge is decremented even when the view raised an exception
+@app.teardown_request
+def stop_request_timer(exception):
+    if g.pop('request_start', None) is not None:
+        requests_in_flight.dec()
+
+# Admission control, with separate budgets so that writes, which serialize
+# on the database lock, cannot take the capacity of the reads
+limiters = {
+    'read': AdmissionLimiter(app.config['ADMISSION_READ_LIMIT'],
+                             app.config['ADMISSION_READ_QUEUE'],
+                             queue_timeout=app.config['ADMISSION_QUEUE_TIMEOUT'],
+                             target_latency=app.config['ADMISSION_READ_TARGET_MS'] / 1000.0),
+    'write': AdmissionLimiter(app.config['ADMISSION_WRITE_LIMIT'],
+                              app.config['ADMISSION_WRITE_QUEUE'],
+                              queue_timeout=app.config['ADMISSION_QUEUE_TIMEOUT'],
+                              target_latency=app.config['ADMISSION_WRITE_TARGET_MS'] / 1000.0),
+}
+registry.gauge('techtrends_admission_limit', 'Number of requests admitted at once.',
+               ('budget',),
+               function=lambda: {(budget,): limiter.stats()['limit']
+                                 for budget, limiter in limiters.items()})
+registry.gauge('techtrends_admission_waiting', 'Number of requests waiting for admission.',
+               ('budget',),
+               function=lambda: {(budget,): limiter.stats()['waiting']
+                                 for budget, limiter in limiters.items()})
+registry.counter('techtrends_admission_rejected_total', 'Number of requests shed.',
+                 ('budget',),
+                 function=lambda: {(budget,): limiter.stats()['rejected']
+                                   for budget, limiter in limiters.items()})
+
+# Endpoints that must answer under overload: probes, metrics, static files
+# and the admin endpoints used to investigate
+ADMISSION_EXEMPT = ('healthz', 'readyz', 'metrics', 'static',
+                    'admin_profiling', 'admin_profile_file', 'admin_queries')
+
+# Function to build a 503 response asking the client to come back later
+def service_unavailable(**body):
+    response = jsonify(**body)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config['ADMISSION_RETRY_AFTER'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Admit the request in its budget, or shed it with a 503 response
+@app.before_request
+def admit_request():
+    if not app.config['ADMISSION_ENABLED'] or request.endpoint in ADMISSION_EXEMPT:
+        return None
+    budget = 'read' if request.method in ('GET', 'HEAD') else 'write'
+    limiter = limiters[budget]
+    try:
+        g.admission = (limiter, limiter.acquire())
+    except Overloaded as e:
+        app.logger.warning('Shedding %s %s: %s', request.method, request.path, e)
+        return service_unavailable(error='overloaded', budget=budget)
+    return None
+
+# Give the admission back, even when the view raised an exception
+@app.teardown_request
+def release_admission(exception):
+    admission = g.pop('admission', None)
+    if admission is not None:
+        limiter, start = admission
+        limiter.release(start)
+
+# Function to check an admin token against `ADMIN_TOKEN`.
+# Without a configured token, nothing is accepted. Tokens are compared as
+# bytes, as `compare_digest` rejects strings with non-ASCII characters
+def is_admin_token(token):
+    expected = app.config['ADMIN_TOKEN']
+    return bool(expected) and bool(token) and hmac.compare_digest(
+        token.encode('utf-8', 'surrogateescape'), expected.encode('utf-8', 'surrogateescape'))
+
+# Function to reject the requests not carrying the admin token as a bearer
+# token. Admin endpoints do not exist when no token is configured
+def require_admin():
+    if not app.config['ADMIN_TOKEN']:
+        abort(404)
+    authorization = request.headers.get('Authorization', '')
+    if not authorization.startswith('Bearer ') or not is_admin_token(authorization[7:]):
+        abort(401)
+
+# Profile the request when it is sampled, or when it carries
+# the admin token in an `X-Profile` header
+@app.before_request
+def start_profiling():
+    if profiler.should_profile(is_admin_token(request.headers.get('X-Profile'))):
+        g.profile = profiler.start()
+
+# Write the profile of the request and report its breakdown
+# in a `Server-Timing` header
+@app.after_request
+def stop_profiling(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        summary = profiler.stop(profile, request.method, request.path, response.status_code)
+        response.headers['Server-Timing'] = 'db;dur=%s, render;dur=%s, total;dur=%s' % (
+            summary['db_ms'], summary['render_ms'], summary['total_ms'])
+    return response
+
+# Abandon the profile of a request that raised an exception
+@app.teardown_request
+def discard_profiling(exception):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.discard(profile)
+
+# Compressed bodies of the responses carrying an ETag, so that pages served
+# from the page cache are not compressed again on every request
+compressed_cache = LRUCache(max_size=app.config['COMPRESSED_CACHE_SIZE'], ttl=3600)
+
+# Compress the response with the preferred encoding accepted by the client.
+# Streamed and file responses, small bodies and content types that do not
+# compress well are sent as they are. A compressed response carries a weak
+# ETag, as its bytes differ from the uncompressed representation.
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or not is_compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    etag, weak = response.get_etag()
+    compressed = MISSING
+    if etag is not None:
+        compressed = compressed_cache.get((etag, encoding))
+    if compressed is MISSING:
+        compressed = compress(data, encoding)
+        if etag is not None:
+            compressed_cache.set((etag, encoding), compressed)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
 
 # Function to get a database connection.
-# This function connects to database with the name `database.db`
+# The connection is taken from the pool once per application context
+# and handed back when the context is torn down
 def get_db_connection():
-    connection = sqlite3.connect('database.db')
-    connection.row_factory = sqlite3.Row
-    return connection
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+# Return the pooled connection at the end of the request
+@app.teardown_appcontext
+def release_db_connection(exception):
+    connection = g.pop('db', None)
+    if connection is not None:
+        pool.release(connection)
+
+# Answer 503 rather than 500 when every pooled connection stayed busy, or
+# when the writer did not commit a post in time
+@app.errorhandler(PoolTimeout)
+@app.errorhandler(WriteTimeout)
+def database_busy(e):
+    app.logger.warning('Shedding %s %s: %s', request.method, request.path, e)
+    return service_unavailable(error='database busy')
+
+# Function to get the ID of the newest post.
+# The ID of the newest post serves as the version of the content, which
+# every create() bumps
+def get_latest_post():
+    connection = get_db_connection()
+    return connection.execute(
+        'SELECT id FROM posts ORDER BY id DESC LIMIT 1').fetchone()
+
+# Function to get the largest post ID in the database
+def get_max_post_id():
+    connection = get_db_connection()
+    return connection.execute('SELECT MAX(id) FROM posts').fetchone()[0]
+
+# Function to get the statistics of the posts, maintained by the triggers
+# of the `post_stats` table. They are read once per request, e.g. once
+# per scrape of `/metrics`
+def get_post_stats():
+    if 'post_stats' not in g:
+        connection = get_db_connection()
+        try:
+            g.post_stats = connection.execute(
+                "SELECT post_count, content_bytes, "
+                "CAST(strftime('%s', newest_created) AS INTEGER) AS newest_created "
+                "FROM post_stats WHERE id = 1").fetchone()
+        except sqlite3.OperationalError:
+            # Database created before the statistics table
+            g.post_stats = None
+    return g.post_stats
+
+# Function to export a statistic of the posts, when available
+def post_stat(name):
+    stats = get_post_stats()
+    if stats is None or stats[name] is None:
+        return {}
+    return stats[name]
+
+registry.gauge('techtrends_posts', 'Number of posts.',
+               function=lambda: post_stat('post_count'))
+registry.gauge('techtrends_posts_content_bytes', 'Total size of the content of the posts.',
+               function=lambda: post_stat('content_bytes'))
+registry.gauge('techtrends_newest_post_created_timestamp_seconds',
+               'Creation time of the newest post.',
+               function=lambda: post_stat('newest_created'))
+
+# Known bound of the post IDs, used to answer lookups of IDs that
+# were never handed out without querying the database
+post_ids = IdUpperBound(get_max_post_id,
+                        refresh_interval=app.config['POST_ID_REFRESH_INTERVAL'])
+
+# Cache of the post IDs below the bound that were found missing
+missing_post_cache = LRUCache(max_size=app.config['MISSING_POST_CACHE_SIZE'],
+                              ttl=app.config['MISSING_POST_CACHE_TTL'])
 
 # Function to get a post using its ID
+# Returns None without a query for IDs known to be missing
 def get_post(post_id):
+    if not post_ids.may_exist(post_id):
+        return None
+    if missing_post_cache.get(post_id) is not MISSING:
+        return None
     connection = get_db_connection()
     post = connection.execute('SELECT * FROM posts WHERE id = ?',
                         (post_id,)).fetchone()
-    connection.close()
+    if post is None:
+        missing_post_cache.set(post_id, True)
     return post
 
-# Define the Flask application
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your secret key'
+# Function to fetch and render a post, and cache its page.
+# Returns the page and the creation time of the post, or None
+def render_post(post_id):
+    post = get_post(post_id)
+    if post is None:
+        return None
+    cached = (render_template('post.html', post=post), parse_timestamp(post['created']))
+    post_cache.set(post_id, cached)
+    return cached
+
+# Concurrent requests for a post missing from the page cache share a
+# single fetch and rendering of the post
+post_flights = SingleFlight(timeout=app.config['POST_COALESCE_TIMEOUT'])
+registry.counter('techtrends_post_flights_total',
+                 'Number of post lookups, by role in the coalesced fetches.', ('role',),
+                 function=lambda: {(role,): post_flights.stats()[role]
+                                   for role in ('leaders', 'followers', 'timeouts')})
+
+# Function to insert a post and get its ID.
+# With group commit enabled the insert shares a transaction with the inserts
+# of concurrent requests, and waits for it at most `DB_POOL_TIMEOUT` seconds
+def insert_post(title, content):
+    sql = 'INSERT INTO posts (title, content) VALUES (?, ?)'
+    if writer is not None:
+        return writer.execute(sql, (title, content), timeout=app.config['DB_WRITE_TIMEOUT'])
+    connection = get_db_connection()
+    cursor = connection.execute(sql, (title, content))
+    connection.commit()
+    return cursor.lastrowid
+
+# Function to insert many posts, given as (title, content) pairs, in a
+# single transaction. The transaction takes the write lock up front, so the
+# AUTOINCREMENT IDs of the posts are consecutive and end with the last
+# inserted row ID. Returns the IDs of the posts, in order.
+def insert_posts(posts):
+    if not posts:
+        return []
+    connection = get_db_connection()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.executemany('INSERT INTO posts (title, content) VALUES (?, ?)', posts)
+        last_id = connection.execute('SELECT last_insert_rowid()').fetchone()[0]
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return list(range(last_id - len(posts) + 1, last_id + 1))
+
+# Function to get several posts in a single query.
+# Returns the posts found, by ID; IDs known to be missing are not queried
+def get_posts_by_ids(ids):
+    ids = [post_id for post_id in set(ids) if post_ids.may_exist(post_id)]
+    if not ids:
+        return {}
+    connection = get_db_connection()
+    posts = connection.execute(
+        'SELECT id, created, title, content FROM posts WHERE id IN (%s)'
+        % ','.join('?' * len(ids)), ids).fetchall()
+    return {post['id']: post for post in posts}
+
+# Function to update the caches once posts were created
+def posts_created(ids):
+    post_ids.observe(max(ids))
+    for post_id in ids:
+        missing_post_cache.delete(post_id)
+    index_cache.clear()
+
+# Range of the IDs SQLite can store; larger numbers make queries fail
+MIN_ROW_ID = -2 ** 63
+MAX_ROW_ID = 2 ** 63 - 1
+
+# Function to encode the position of a post in the listing as an opaque cursor
+def encode_cursor(post):
+    position = '%s|%d' % (post['created'], post['id'])
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+# Function to decode a cursor into the (created, id) pair it points at.
+# A ValueError is raised for cursors that were not produced by `encode_cursor`
+def decode_cursor(cursor):
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created, post_id = position.rsplit('|', 1)
+        post_id = int(post_id)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('invalid cursor: %r' % cursor)
+    if not MIN_ROW_ID <= post_id <= MAX_ROW_ID:
+        raise ValueError('invalid cursor: %r' % cursor)
+    return created, post_id
+
+# Function to query one page of posts, newest first.
+# Pages are addressed by keyset: the page after `cursor` starts with the
+# first post older than the (created, id) pair the cursor points at, so
+# the query walks the `posts_created_id` index instead of skipping rows.
+# Only the columns shown in the listing are selected.
+# Returns the SQLite cursor, which yields up to `limit` + 1 rows; the extra
+# row tells whether a next page exists. The connection of the request is
+# used unless another one is given.
+def query_posts_page(cursor, limit, connection=None):
+    if connection is None:
+        connection = get_db_connection()
+    if cursor is None:
+        return connection.execute(
+            'SELECT id, created, title FROM posts '
+            'ORDER BY created DESC, id DESC LIMIT ?',
+            (limit + 1,))
+    created, post_id = decode_cursor(cursor)
+    return connection.execute(
+        'SELECT id, created, title FROM posts '
+        'WHERE (created, id) < (?, ?) '
+        'ORDER BY created DESC, id DESC LIMIT ?',
+        (created, post_id, limit + 1))
+
+# Function to get one page of posts, newest first.
+# Returns the posts of the page and the cursor of the next page, if any.
+def get_posts_page(cursor=None, limit=None):
+    if limit is None:
+        limit = app.config['POSTS_PER_PAGE']
+    posts = query_posts_page(cursor, limit).fetchall()
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor(posts[-1])
+    return posts, next_cursor
+
+# One page of posts read from the database while it is iterated.
+# The page is sent after the view returned and its application context,
+# with the connection of the request, may be gone: the rows are read on a
+# connection held by the iteration itself, until it ends or is closed.
+# `next_cursor` is only known once the iteration is over.
+class PostStream:
+    def __init__(self, cursor, limit):
+        self.cursor = cursor
+        self.limit = limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        connection = pool.acquire()
+        try:
+            count = 0
+            last = None
+            for row in query_posts_page(self.cursor, self.limit, connection):
+                if count == self.limit:
+                    self.next_cursor = encode_cursor(last)
+                    break
+                count += 1
+                last = row
+                yield row
+        finally:
+            pool.release(connection)
+
+# Function to read the `cursor` and `limit` query parameters of a listing.
+# Invalid values are answered with a 400 response
+def get_page_args(max_limit=None):
+    if max_limit is None:
+        max_limit = app.config['MAX_POSTS_PER_PAGE']
+    cursor = request.args.get('cursor') or None
+    try:
+        limit = int(request.args.get('limit', app.config['POSTS_PER_PAGE']))
+        if cursor is not None:
+            decode_cursor(cursor)
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    return cursor, min(limit, max_limit)
+
+# Markers around the matched terms in the snippets of the search results
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+# Function to turn the words typed by a user into an FTS5 query.
+# Each word is quoted, so that the characters of the FTS5 query syntax are
+# matched literally, and posts must match every word
+def build_match_query(text):
+    words = text.split()
+    return ' '.join('"%s"' % word.replace('"', '""') for word in words)
+
+# Function to search the posts, best matches first.
+# Returns the matching posts of the page, with a snippet of their content
+# around the matched words, and whether more results follow
+def search_posts(text, page=1, limit=None):
+    if limit is None:
+        limit = app.config['POSTS_PER_PAGE']
+    match = build_match_query(text)
+    if not match:
+        return [], False
+    connection = get_db_connection()
+    results = connection.execute(
+        'SELECT posts.id, posts.created, posts.title, '
+        "snippet(posts_fts, 1, ?, ?, '...', 16) AS snippet "
+        'FROM posts_fts JOIN posts ON posts.id = posts_fts.rowid '
+        'WHERE posts_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?',
+        (MATCH_START, MATCH_END, match, limit + 1, (page - 1) * limit)).fetchall()
+    return results[:limit], len(results) > limit
+
+# Function to render a snippet with its matched words highlighted
+def highlight(snippet):
+    escaped = str(escape(snippet))
+    return Markup(escaped.replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>'))
+
+# Control characters of a search, replaced by spaces: FTS5 reads a NUL
+# character as the end of the query
+CONTROL_CHARACTERS = dict.fromkeys(list(range(32)) + [127], ' ')
+
+# Function to read the `q`, `page` and `limit` query parameters of a search.
+# Invalid values, and pages past the largest offset SQLite takes, are
+# answered with a 400 response
+def get_search_args():
+    query = request.args.get('q', '').translate(CONTROL_CHARACTERS).strip()
+    try:
+        page = int(request.args.get('page', '1'))
+        limit = int(request.args.get('limit', app.config['POSTS_PER_PAGE']))
+    except ValueError:
+        abort(400)
+    if page < 1 or limit < 1:
+        abort(400)
+    limit = min(limit, app.config['MAX_POSTS_PER_PAGE'])
+    if page - 1 > MAX_ROW_ID // limit:
+        abort(400)
+    return query, page, limit
+
+# Function to render a template in chunks of `buffer` items, as it is
+# iterated. The request context is kept alive until the last chunk is sent
+def stream_template(template_name, buffer, **context):
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(buffer)
+    return Response(stream_with_context(stream))
+
+# Function to stream the listing page: rows are read from the database
+# cursor while the page is sent, so neither the posts nor the HTML of a page
+# are held in memory as a whole. Streamed pages are not cached.
+def stream_index(cursor, limit):
+    posts = PostStream(cursor, limit)
+    return stream_template('index.html', app.config['STREAM_BUFFER_POSTS'],
+                           posts=posts, cursor=cursor, next_cursor=None, limit=limit)
 
 # Define the main route of the web application 
+# Clients holding the current version of a listing page get a 304 response.
+# Listings have no Last-Modified date: the creation time of the newest post
+# is set by the clock of the process that created it and may go backwards,
+# so only the ETag, bumped by every post, tells the versions apart
 @app.route('/')
 def index():
-    connection = get_db_connection()
-    posts = connection.execute('SELECT * FROM posts').fetchall()
-    connection.close()
-    return render_template('index.html', posts=posts)
+    if app.config['STREAM_INDEX']:
+        cursor, limit = get_page_args(app.config['STREAM_MAX_POSTS_PER_PAGE'])
+    else:
+        cursor, limit = get_page_args()
+    latest = get_latest_post()
+    version = latest['id'] if latest is not None else 0
+    if latest is not None:
+        # Posts created by other processes become reachable right away
+        post_ids.observe(version)
+    etag = make_etag('index', template_version, version, cursor, limit)
+    max_age = app.config['INDEX_MAX_AGE']
+    if is_not_modified(request, etag):
+        return not_modified_response(Response, etag, max_age=max_age)
+
+    if app.config['STREAM_INDEX']:
+        response = stream_index(cursor, limit)
+    else:
+        page = index_cache.get((version, cursor, limit))
+        if page is MISSING:
+            posts, next_cursor = get_posts_page(cursor, limit)
+            page = render_template('index.html', posts=posts, cursor=cursor,
+                                   next_cursor=next_cursor, limit=limit)
+            index_cache.set((version, cursor, limit), page)
+        response = make_response(page)
+    return set_cache_headers(response, etag, max_age=max_age)
 
 # Define how each individual article is rendered 
 # If the post ID is not found a 404 page is shown
+# Posts never change, so clients holding a post page get a 304 response
 @app.route('/<int:post_id>')
 def post(post_id):
-    post = get_post(post_id)
-    if post is None:
-      return render_template('404.html'), 404
-    else:
-      return render_template('post.html', post=post)
+    etag = make_etag('post', template_version, post_id)
+    max_age = app.config['POST_MAX_AGE']
+    cached = post_cache.get(post_id)
+    if cached is MISSING:
+        cached = post_flights.do(post_id, lambda: render_post(post_id))
+        if cached is None:
+          return not_found_page, 404
+    page, last_modified = cached
+    if app.config['VIEW_COUNTS'] and not request.environ.get('techtrends.warm_up'):
+        post_views.inc(post_id)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(Response, etag, last_modified, max_age)
+    return set_cache_headers(make_response(page), etag, last_modified, max_age)
 
 # Define the About Us page
 @app.route('/about')
 def about():
-    return render_template('about.html')
+    etag = make_etag('about', template_version)
+    max_age = app.config['ABOUT_MAX_AGE']
+    if is_not_modified(request, etag):
+        return not_modified_response(Response, etag, max_age=max_age)
+    return set_cache_headers(make_response(render_template('about.html')), etag,
+                             max_age=max_age)
 
 # Define the post creation functionality 
 @app.route('/create', methods=('GET', 'POST'))
@@ -55,16 +800,381 @@ def create():
         if not title:
             flash('Title is required!')
         else:
-            connection = get_db_connection()
-            connection.execute('INSERT INTO posts (title, content) VALUES (?, ?)',
-                         (title, content))
-            connection.commit()
-            connection.close()
+            post_id = insert_post(title, content)
+            posts_created([post_id])
 
             return redirect(url_for('index'))
 
     return render_template('create.html')
 
+# Define the search page
+@app.route('/search')
+def search():
+    query, page, limit = get_search_args()
+    results, has_next = search_posts(query, page, limit)
+    results = [dict(result, snippet=highlight(result['snippet'])) for result in results]
+    return render_template('search.html', query=query, results=results,
+                           page=page, limit=limit, has_next=has_next)
+
+# Define the search API, returning the results as JSON
+@app.route('/api/search')
+def api_search():
+    query, page, limit = get_search_args()
+    results, has_next = search_posts(query, page, limit)
+    return jsonify(
+        query=query,
+        page=page,
+        limit=limit,
+        next_page=page + 1 if has_next else None,
+        results=[{
+            'id': result['id'],
+            'created': result['created'],
+            'title': result['title'],
+            'snippet': result['snippet'].replace(MATCH_START, '').replace(MATCH_END, ''),
+        } for result in results])
+
+# Function to convert a post to JSON
+def post_to_json(post):
+    return {key: post[key] for key in post.keys()}
+
+# Function to get the post IDs of the `ids` argument, e.g. `?ids=1,2,3`
+def get_ids_arg():
+    try:
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        abort(400)
+    if len(ids) > app.config['API_MAX_IDS']:
+        abort(400)
+    if any(not MIN_ROW_ID <= post_id <= MAX_ROW_ID for post_id in ids):
+        abort(400)
+    return ids
+
+# Function to get the number of views of posts written to the database
+def get_written_views(connection, ids):
+    if not ids:
+        return {}
+    try:
+        rows = connection.execute(
+            'SELECT post_id, views FROM post_views WHERE post_id IN (%s)'
+            % ','.join('?' * len(ids)), ids).fetchall()
+    except sqlite3.OperationalError:
+        # Database created before the views table
+        rows = []
+    return {row['post_id']: row['views'] for row in rows}
+
+# Function to get the number of views of posts: the views written to the
+# database plus the views counted by this process and not written yet.
+# The connection is taken first, as flushes wait while the views are read
+def get_post_views(ids):
+    connection = get_db_connection()
+    return post_views.totals(list(dict.fromkeys(ids)),
+                             lambda ids: get_written_views(connection, ids))
+
+# Define the posts API.
+# Without parameters, or with `cursor` and `limit`, it lists the posts
+# newest first, like the main page. With `ids`, e.g. `?ids=1,2,3`, it
+# returns these posts, in the requested order, fetched with a single query.
+@app.route('/api/posts')
+def api_posts():
+    if 'ids' in request.args:
+        ids = get_ids_arg()
+        posts = get_posts_by_ids(ids)
+        return jsonify(
+            posts=[post_to_json(posts[post_id]) for post_id in ids if post_id in posts],
+            missing=[post_id for post_id in ids if post_id not in posts])
+    cursor, limit = get_page_args()
+    posts, next_cursor = get_posts_page(cursor, limit)
+    return jsonify(posts=[post_to_json(post) for post in posts],
+                   next_cursor=next_cursor)
+
+# Define the view counts API, e.g. `/api/posts/views?ids=1,2,3`
+@app.route('/api/posts/views')
+def api_post_views():
+    views = get_post_views(get_ids_arg())
+    return jsonify(views={str(post_id): count for post_id, count in views.items()})
+
+# Define the bulk creation API.
+# The body is a JSON list of posts, or an object with a `posts` list, each
+# post having a `title` and a `content`. Valid posts are inserted in a single
+# transaction; the response has one result per post, in order, with either
+# the ID of the created post or the reason it was rejected.
+@app.route('/api/posts/bulk', methods=('POST',))
+def api_posts_bulk():
+    body = request.get_json(silent=True)
+    items = body.get('posts') if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        return jsonify(error='expected a list of posts'), 400
+    if len(items) > app.config['API_MAX_BULK_POSTS']:
+        return jsonify(error='at most %d posts per request'
+                       % app.config['API_MAX_BULK_POSTS']), 400
+
+    results = []
+    valid = []
+    for item in items:
+        if not isinstance(item, dict):
+            results.append({'status': 'rejected', 'error': 'expected an object'})
+        elif not isinstance(item.get('title'), str) or not item['title']:
+            results.append({'status': 'rejected', 'error': 'title is required'})
+        elif not isinstance(item.get('content', ''), str):
+            results.append({'status': 'rejected', 'error': 'content must be a string'})
+        else:
+            results.append(None)
+            valid.append((item['title'], item.get('content', '')))
+
+    ids = iter(insert_posts(valid))
+    for index, result in enumerate(results):
+        if result is None:
+            results[index] = {'status': 'created', 'id': next(ids)}
+    created = len(valid)
+    if created:
+        posts_created([result['id'] for result in results if result['status'] == 'created'])
+    return jsonify(created=created, rejected=len(items) - created,
+                   results=results), 201 if created else 200
+
+# Define the cache statistics endpoint
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify(post=post_cache.stats(), index=index_cache.stats(),
+                   post_flights=post_flights.stats())
+
+# Define the metrics endpoint, in the Prometheus text format
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+# Lag of the worker threads, measured once the readiness probe is called
+worker_lag = LagMonitor()
+
+# Define the liveness endpoint: the process is able to serve requests
+@app.route('/healthz')
+def healthz():
+    response = jsonify(result='OK - healthy')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Function to check whether the process has capacity for more requests.
+# Returns the measured values and the reasons the process is not ready.
+def check_readiness():
+    reasons = []
+    if not warmed_up.is_set():
+        reasons.append('warming up')
+
+    # The probe itself is in flight
+    in_flight = requests_in_flight.value() - 1
+    if in_flight >= app.config['READY_MAX_IN_FLIGHT']:
+        reasons.append('too many requests in flight')
+
+    worker_lag.start()
+    lag = max(worker_lag.lag(), request.environ.get('techtrends.loop_lag', 0.0))
+    if lag * 1000 >= app.config['READY_MAX_LAG_MS']:
+        reasons.append('workers lagging')
+
+    stats = pool.stats()
+    pool_usage = stats['in_use'] / stats['max_size']
+    if pool_usage >= app.config['READY_MAX_POOL_USAGE']:
+        reasons.append('database pool saturated')
+    else:
+        try:
+            connection = pool.acquire(app.config['READY_DB_TIMEOUT'])
+            try:
+                connection.execute('SELECT 1 FROM posts LIMIT 1').fetchone()
+            finally:
+                pool.release(connection)
+        except (sqlite3.Error, PoolTimeout) as e:
+            app.logger.warning('Readiness database check failed: %s', e)
+            reasons.append('database unavailable')
+
+    checks = {
+        'in_flight': in_flight,
+        'lag_ms': round(lag * 1000, 3),
+        'db_pool_usage': round(pool_usage, 3),
+    }
+    return checks, reasons
+
+# Define the readiness endpoint.
+# Answers 503 while the process is warming up, overloaded or cut off from
+# the database, so that no new request is routed to it.
+@app.route('/readyz')
+def readyz():
+    checks, reasons = check_readiness()
+    if reasons:
+        response = jsonify(result='not ready', reasons=reasons, checks=checks)
+        response.status_code = 503
+    else:
+        response = jsonify(result='OK - ready', checks=checks)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Define the profiling admin endpoint.
+# POST a JSON object with `enabled` and/or `sample_rate` to change the
+# settings; the response lists the settings and the latest profiles
+@app.route('/admin/profiling', methods=('GET', 'POST'))
+def admin_profiling():
+    require_admin()
+    if request.method == 'POST':
+        settings = request.get_json(silent=True)
+        if not isinstance(settings, dict):
+            abort(400)
+        if 'enabled' in settings:
+            profiler.enabled = bool(settings['enabled'])
+        if 'sample_rate' in settings:
+            try:
+                sample_rate = float(settings['sample_rate'])
+            except (TypeError, ValueError):
+                abort(400)
+            if not 0 <= sample_rate <= 1:
+                abort(400)
+            profiler.sample_rate = sample_rate
+    return jsonify(profiler.state())
+
+# Define the download of the files written by the profiler
+@app.route('/admin/profiling/<path:name>')
+def admin_profile_file(name):
+    require_admin()
+    if profiler.output_dir is None:
+        abort(404)
+    return send_from_directory(profiler.output_dir, name)
+
+# Define the query statistics admin endpoint.
+# It lists the timing statistics of every statement, slowest in total first,
+# and the latest slow statements with their query plan. DELETE resets them.
+@app.route('/admin/queries', methods=('GET', 'DELETE'))
+def admin_queries():
+    require_admin()
+    if request.method == 'DELETE':
+        query_stats.reset()
+    return jsonify(slow_query_ms=app.config['SLOW_QUERY_MS'],
+                   queries=query_stats.snapshot(),
+                   slow_queries=list(query_stats.slow_queries))
+
+# Content hashes of the static files, computed once per file
+static_hashes = {}
+
+# Function to get the content hash of a static file
+def static_file_hash(filename):
+    value = static_hashes.get(filename)
+    if value is None:
+        path = os.path.join(app.static_folder, filename)
+        value = file_hash(path) if os.path.isfile(path) else ''
+        static_hashes[filename] = value
+    return value
+
+# Version the URLs of the static files with their content hash,
+# e.g. `/static/css/main.css?v=0123456789ab`, so they can be cached forever
+@app.url_defaults
+def add_static_hash(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        values['v'] = static_file_hash(values['filename'])
+
+# Function to tell whether the pre-compressed variant of a static file was
+# written after the file. A variant left over from an older version of the
+# file would otherwise be served, and cached forever, under the URL of the
+# new version.
+def is_fresh_variant(filename, encoding):
+    path = os.path.join(app.static_folder, filename)
+    try:
+        return os.path.getmtime(path + EXTENSIONS[encoding]) >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+# Serve the static files.
+# The pre-compressed variants written by `compress_static.py` are sent to
+# the clients accepting their encoding, unless they are stale. URLs
+# versioned with the hash of the file served are cached forever; other URLs,
+# e.g. one versioned by another release of the file during a deployment,
+# only briefly.
+def static(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = None
+    if is_compressible(mimetype):
+        for encoding in available_encodings():
+            if request.accept_encodings[encoding] <= 0:
+                continue
+            try:
+                response = send_from_directory(app.static_folder,
+                                               filename + EXTENSIONS[encoding],
+                                               mimetype=mimetype)
+            except NotFound:
+                continue
+            if not is_fresh_variant(filename, encoding):
+                response.close()
+                response = None
+                continue
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(app.static_folder, filename)
+    if is_compressible(mimetype):
+        response.vary.add('Accept-Encoding')
+    if request.args.get('v') == static_file_hash(filename):
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % app.config['STATIC_MAX_AGE']
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=%d' % app.config['STATIC_UNVERSIONED_MAX_AGE']
+    return response
+
+app.view_functions['static'] = static
+
+# Function to compile every template, before the first request needs it
+def precompile_templates():
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+precompile_templates()
+
+# Set once the application is warmed up, see `warm_up`; without warm-up,
+# the application is ready once loaded
+warmed_up = threading.Event()
+if not app.config['WARM_UP']:
+    warmed_up.set()
+
+# Held once the warm-up was started on a first request
+warm_up_started = threading.Lock()
+
+# Function to send a request to every route through the test client, so
+# that the code paths, queries and caches of the application are exercised
+# before the first client request. Nothing is written to the database, and
+# the requests are left out of the metrics.
+# Returns the (path, status) of the requests.
+def warm_up():
+    results = []
+    if app.config['WARM_UP']:
+        start = time.perf_counter()
+        with app.app_context():
+            latest = get_latest_post()
+        paths = ['/', '/about', '/create', '/search?q=cloud', '/api/search?q=cloud',
+                 '/api/posts', '/cache-stats', '/metrics', '/0']
+        if latest is not None:
+            paths += ['/%d' % latest['id'], '/api/posts?ids=%d' % latest['id'],
+                      '/api/posts/views?ids=%d' % latest['id']]
+        with app.test_request_context('/'):
+            paths.append(url_for('static', filename='css/main.css'))
+        client = app.test_client()
+        for path in paths:
+            response = client.get(path, headers={'Accept-Encoding': 'br, gzip'},
+                                  environ_overrides={'techtrends.warm_up': True})
+            response.get_data()
+            response.close()
+            results.append((path, response.status_code))
+        app.logger.info('Warmed up %d routes in %.3fs', len(results), time.perf_counter() - start)
+    warmed_up.set()
+    return results
+
+# Function to warm up the application in the background on its first
+# request, when it was loaded by a server that does not call `warm_up`,
+# e.g. `gunicorn app:app` or `flask run`. Until then, the process is not
+# ready.
+@app.before_request
+def start_warm_up():
+    if warmed_up.is_set() or request.environ.get('techtrends.warm_up'):
+        return
+    if warm_up_started.acquire(blocking=False):
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+# The 404 page does not depend on the request, so it is rendered only once
+with app.test_request_context('/'):
+    not_found_page = render_template('404.html')
+
 # start the application on port 3111
 if __name__ == "__main__":
+   warm_up()
    app.run(host='0.0.0.0', port='3111')
@@ -0,0 +1,253 @@
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, warm_up
+from health import LagMonitor
+
+
+# Serve a WSGI application over ASGI.
+# The request body is received and the response is sent by the event loop,
+# so slow clients only cost a coroutine. The blocking part of a request,
+# i.e. running the view with its SQLite queries and template rendering,
+# is offloaded to a bounded pool of `max_workers` threads. A request runs on
+# a single thread from start to end, as the application context and the
+# pooled connection of a request belong to the thread that created them;
+# streamed responses are handed over to the event loop through a queue of
+# at most `buffer_chunks` chunks. The blocking `on_startup` function runs
+# before the server accepts connections. The lag of the event loop is
+# passed to the application in the `techtrends.loop_lag` environ key.
+# At most `max_queue` requests wait for a worker thread; the next ones are
+# answered 503 by the event loop, with a `Retry-After` of `retry_after`.
+# Under overload the probes must still answer: `live_path` is answered by
+# the event loop itself, and `priority_paths`, e.g. the readiness probe and
+# the metrics, are never shed and run on a thread of their own rather than
+# behind the queued requests.
+class AsgiAdapter:
+    def __init__(self, wsgi_app, max_workers=8, buffer_chunks=16, on_startup=None,
+                 max_queue=None, retry_after=1, live_path=None, priority_paths=()):
+        self.wsgi_app = wsgi_app
+        self.on_startup = on_startup
+        self.max_workers = max_workers
+        self.buffer_chunks = buffer_chunks
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.live_path = live_path
+        self.priority_paths = frozenset(priority_paths)
+        self._pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='techtrends-asgi')
+        self.priority_executor = ThreadPoolExecutor(max_workers=1,
+                                                    thread_name_prefix='techtrends-asgi-priority')
+        self.loop_lag = LagMonitor()
+        self._lag_task = None
+
+    # Start measuring the lag of the running event loop
+    def watch_loop_lag(self):
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.ensure_future(self.loop_lag.watch())
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+        else:
+            raise ValueError('unsupported ASGI scope type: %r' % scope['type'])
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.watch_loop_lag()
+                if self.on_startup is not None:
+                    loop = asyncio.get_running_loop()
+                    try:
+                        await loop.run_in_executor(self.executor, self.on_startup)
+                    except Exception as e:
+                        await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                        return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._lag_task is not None:
+                    self._lag_task.cancel()
+                self.executor.shutdown(wait=True)
+                self.priority_executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Read the whole request body without blocking a worker thread
+    async def read_body(self, receive):
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        return b''.join(chunks)
+
+    async def handle_http(self, scope, receive, send):
+        if scope['path'] == self.live_path:
+            await self.send_json(send, 200, b'{"result": "OK - healthy"}')
+            return
+        if scope['path'] in self.priority_paths:
+            await self.run_http(scope, receive, send, self.priority_executor)
+            return
+        if self.max_queue is not None and self._pending >= self.max_workers + self.max_queue:
+            await self.send_json(send, 503, b'{"error": "overloaded"}',
+                                 [(b'retry-after', str(self.retry_after).encode('latin-1'))])
+            return
+        self._pending += 1
+        try:
+            await self.run_http(scope, receive, send, self.executor)
+        finally:
+            self._pending -= 1
+
+    # Answer a request from the event loop, without reaching a worker thread
+    async def send_json(self, send, status, body, headers=()):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode('latin-1')),
+                                (b'cache-control', b'no-store')] + list(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def run_http(self, scope, receive, send, executor):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        environ = build_environ(scope, body)
+        self.watch_loop_lag()
+        environ['techtrends.loop_lag'] = self.loop_lag.lag()
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(maxsize=self.buffer_chunks)
+        response = {}
+        cancelled = threading.Event()
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        # Runs on a worker thread: call the application and queue its chunks.
+        # The queue ends with None, or with the exception that was raised.
+        def run():
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if cancelled.is_set():
+                            break
+                        if chunk:
+                            put(chunk)
+                finally:
+                    close = getattr(result, 'close', None)
+                    if close is not None:
+                        close()
+            except Exception as error:
+                put(error)
+            else:
+                put(None)
+
+        worker = loop.run_in_executor(executor, run)
+        started = False
+        try:
+            while True:
+                item = await chunks.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    if started:
+                        # Part of the page was sent: let the server abort
+                        # the connection, so that the client and the caches
+                        # do not take the truncated page for a complete one
+                        raise item
+                    break
+                if not started:
+                    await send({'type': 'http.response.start',
+                                'status': response['status'],
+                                'headers': response['headers']})
+                    started = True
+                await send({'type': 'http.response.body', 'body': item,
+                            'more_body': True})
+            if not started:
+                if isinstance(item, Exception):
+                    response = {'status': 500,
+                                'headers': [(b'content-type', b'text/plain; charset=utf-8')]}
+                await send({'type': 'http.response.start',
+                            'status': response['status'],
+                            'headers': response['headers']})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Unblock the worker thread if the client went away mid-response
+            cancelled.set()
+            while not worker.done():
+                try:
+                    chunks.get_nowait()
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(0.001)
+            await worker
+
+
+# Build the WSGI environment of an ASGI HTTP request, following PEP 3333
+def build_environ(scope, body):
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if not path.startswith(script_name):
+        path = script_name + path
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path[len(script_name):].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'] = server[0]
+    environ['SERVER_PORT'] = str(server[1])
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+        environ['REMOTE_PORT'] = str(client[1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    environ.setdefault('CONTENT_LENGTH', str(len(body)))
+    return environ
+
+
+# The ASGI application, e.g. `uvicorn asgi:application --port 3111`.
+# The number of worker threads defaults to the size of the connection pool,
+# as more threads would only wait for a free connection.
+application = AsgiAdapter(
+    app, max_workers=int(os.environ.get('TECHTRENDS_ASGI_THREADS', app.config['DB_POOL_SIZE'])),
+    on_startup=warm_up,
+    max_queue=int(os.environ.get('TECHTRENDS_ASGI_QUEUE', '256')),
+    retry_after=app.config['ADMISSION_RETRY_AFTER'],
+    live_path='/healthz', priority_paths=('/readyz', '/metrics'))
+
+# start the application on port 3111 with uvicorn
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(application, host='0.0.0.0', port=3111)
@@ -0,0 +1,308 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from load_posts import connect, generate_posts, load_posts
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+ROUTES = ('index', 'post', 'create', 'about')
+
+# Metrics compared against a baseline; True when higher is better
+COMPARED = (('p50', False), ('p95', False), ('p99', False), ('throughput', True))
+
+# Settings a run must share with its baseline to be compared with it
+SETTINGS = ('target', 'posts', 'concurrency')
+
+
+# Create a database with `size` synthetic posts in `folder`
+def seed_database(folder, size, seed=0):
+    database = os.path.join(folder, 'database.db')
+    connection = connect(database)
+    with open(os.path.join(HERE, 'schema.sql')) as f:
+        connection.executescript(f.read())
+    load_posts(connection, generate_posts(size, seed))
+    connection.close()
+    return database
+
+
+# Build the (method, path, form) of the next request to `route`
+def make_request(route, rng, size):
+    if route == 'index':
+        return 'GET', '/', None
+    if route == 'post':
+        return 'GET', '/%d' % rng.randint(1, size), None
+    if route == 'about':
+        return 'GET', '/about', None
+    if route == 'create':
+        return 'POST', '/create', {'title': 'Benchmark post %d' % rng.randint(1, 10 ** 9),
+                                   'content': 'Created by the benchmark.'}
+    raise ValueError('unknown route: %r' % route)
+
+
+# Send requests through the Flask test client of an in-process application
+class TestClientTarget:
+    def __init__(self, database):
+        os.environ['TECHTRENDS_DATABASE'] = database
+        # Logs are written as usual, but not mixed with the results
+        os.environ.setdefault('TECHTRENDS_LOG_FILE', os.devnull)
+        sys.path.insert(0, HERE)
+        import app
+        self.app = app.app
+        # Warm up now rather than in the background of the first measured
+        # request, as servers do before accepting connections
+        app.warm_up()
+
+    def client(self):
+        client = self.app.test_client()
+
+        def send(method, path, form):
+            response = client.open(path, method=method, data=form)
+            response.get_data()
+            status = response.status_code
+            response.close()
+            return status
+        return send
+
+    def rss(self):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def close(self):
+        pass
+
+
+# Send requests over HTTP to a production server started for the benchmark
+class ServerTarget:
+    def __init__(self, database, workers):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        env = dict(os.environ,
+                   TECHTRENDS_DATABASE=database,
+                   TECHTRENDS_BIND='127.0.0.1:%d' % self.port,
+                   TECHTRENDS_WORKERS=str(workers))
+        self.process = subprocess.Popen([sys.executable, os.path.join(HERE, 'serve.py')],
+                                        cwd=HERE, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                break
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError('the server did not start')
+                time.sleep(0.1)
+
+    def client(self):
+        def send(method, path, form):
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            try:
+                body = urlencode(form) if form else None
+                headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form else {}
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                return response.status
+            finally:
+                connection.close()
+        return send
+
+    # Resident memory of the server and its workers, read from /proc
+    def rss(self):
+        total = 0
+        pids = [self.process.pid]
+        try:
+            with open('/proc/%d/task/%d/children' % (self.process.pid, self.process.pid)) as f:
+                pids += [int(pid) for pid in f.read().split()]
+        except OSError:
+            pass
+        for pid in pids:
+            try:
+                with open('/proc/%d/status' % pid) as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                pass
+        return total
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+# Value at `fraction` of the sorted `values`, by the nearest-rank method
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+# Send `requests` requests to `route` from `concurrency` threads.
+# Returns the latency percentiles, in milliseconds, the throughput,
+# in requests per second, and the number of errors.
+def run_route(target, route, requests, concurrency, size, seed=0):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker(number):
+        send = target.client()
+        rng = random.Random(seed * 1000 + number)
+        local = []
+        local_errors = 0
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            method, path, form = make_request(route, rng, size)
+            start = time.perf_counter()
+            try:
+                status = send(method, path, form)
+            except (OSError, http.client.HTTPException):
+                status = None
+            local.append(time.perf_counter() - start)
+            if status is None or status >= 500:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'throughput': len(latencies) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+# Compare `results` with a `baseline`.
+# Returns the descriptions of the metrics worse than the baseline by more
+# than `tolerance`, a fraction of the baseline value. Raises ValueError
+# when the baseline was measured with other settings.
+def find_regressions(results, baseline, tolerance):
+    mismatches = ['%s %s, not %s' % (name, results[name], baseline.get(name))
+                  for name in SETTINGS if results[name] != baseline.get(name)]
+    if mismatches:
+        raise ValueError('the baseline was measured with other settings: '
+                         + ', '.join(mismatches))
+    regressions = []
+    for route, result in results['routes'].items():
+        reference = baseline.get('routes', {}).get(route)
+        if reference is None:
+            continue
+        for metric, higher_is_better in COMPARED:
+            old, new = reference[metric], result[metric]
+            if higher_is_better:
+                worse = new < old * (1 - tolerance)
+            else:
+                worse = new > old * (1 + tolerance)
+            if worse:
+                regressions.append('%s %s: %.2f -> %.2f' % (route, metric, old, new))
+    return regressions
+
+
+def print_results(results):
+    print('%-8s %9s %7s %9s %9s %9s %12s'
+          % ('route', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for route, result in results['routes'].items():
+        print('%-8s %9d %7d %9.2f %9.2f %9.2f %12.1f'
+              % (route, result['requests'], result['errors'], result['p50'],
+                 result['p95'], result['p99'], result['throughput']))
+    print('RSS: %.1f MB' % (results['rss'] / 1024.0 / 1024.0))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the TechTrends routes.')
+    parser.add_argument('--target', choices=('client', 'server'), default='client',
+                        help='drive the Flask test client in this process, '
+                             'or a production server started for the benchmark')
+    parser.add_argument('--posts', type=int, default=10000,
+                        help='number of posts in the benchmark database')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--workers', type=int, default=2, help='server worker processes')
+    parser.add_argument('--routes', default=','.join(ROUTES),
+                        help='comma separated routes among %s' % ', '.join(ROUTES))
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', metavar='FILE', help='write the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare with the JSON results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed regression, as a fraction of the baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    routes = [route.strip() for route in args.routes.split(',') if route.strip()]
+    for route in routes:
+        if route not in ROUTES:
+            raise SystemExit('unknown route: %s' % route)
+
+    with tempfile.TemporaryDirectory() as folder:
+        database = seed_database(folder, args.posts, args.seed)
+        if args.target == 'server':
+            target = ServerTarget(database, args.workers)
+        else:
+            target = TestClientTarget(database)
+        try:
+            results = {'target': args.target, 'posts': args.posts,
+                       'concurrency': args.concurrency, 'routes': {}}
+            for route in routes:
+                results['routes'][route] = run_route(target, route, args.requests,
+                                                     args.concurrency, args.posts, args.seed)
+            results['rss'] = target.rss()
+        finally:
+            target.close()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        try:
+            regressions = find_regressions(results, baseline, args.tolerance)
+        except ValueError as e:
+            print('Cannot compare with %s: %s' % (args.baseline, e))
+            return 2
+        if regressions:
+            print('Regressions against %s:' % args.baseline)
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+        print('No regression against %s' % args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
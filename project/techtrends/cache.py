@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Sentinel returned by `LRUCache.get` when a key is not cached
+MISSING = object()
+
+
+# A bounded least-recently-used cache whose entries expire after `ttl` seconds.
+# Every operation takes a lock, so a single cache can be shared by all the
+# request threads of a process. Hits, misses, evictions and expirations are
+# counted so the cache can be sized from its statistics.
+class LRUCache:
+    def __init__(self, max_size=1024, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Get the cached value of `key`, or `MISSING`
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, expires = entry
+            if expires <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Cache `value` under `key`, evicting the least recently used entries
+    # once the cache is full
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Drop a single entry
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    # Drop every entry
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Snapshot of the cache counters
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+# Upper bound of the ids handed out by an AUTOINCREMENT column.
+# Ids above the bound cannot exist, so lookups for them can be answered
+# without a query. `load` returns the current largest id; it is called again
+# at most once every `refresh_interval` seconds when an id above the bound is
+# requested, to pick up rows inserted by other processes.
+class IdUpperBound:
+    def __init__(self, load, refresh_interval=1.0):
+        self._load = load
+        self.refresh_interval = refresh_interval
+        self._max_id = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    # Whether a row with `row_id` may exist
+    def may_exist(self, row_id):
+        if row_id < 1:
+            return False
+        max_id = self._max_id
+        if max_id is not None and row_id <= max_id:
+            return True
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.refresh_interval:
+            return False
+        self.refresh()
+        return row_id <= self._max_id
+
+    # Reload the bound from the database
+    def refresh(self):
+        max_id = self._load() or 0
+        with self._lock:
+            self._max_id = max(max_id, self._max_id or 0)
+            self._loaded_at = time.monotonic()
+
+    # Record an id inserted by this process
+    def observe(self, row_id):
+        with self._lock:
+            if self._max_id is None or row_id > self._max_id:
+                self._max_id = row_id
+
+
+# A call in progress in a `SingleFlight`
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Coalesces concurrent calls for the same key: the first caller, the
+# leader, runs the function while the callers arriving meanwhile wait for
+# its result instead of running it again. A leader stuck for more than
+# `timeout` seconds is abandoned: one of its waiters becomes the leader of
+# a new call, which the other waiters then follow.
+class SingleFlight:
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    # Call `function` for `key`, or wait for the result of the call in progress
+    def do(self, key, function):
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    self.leaders += 1
+                    break
+                self.followers += 1
+            if flight.done.wait(self.timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            with self._lock:
+                self.timeouts += 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+        try:
+            flight.result = function()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    # Snapshot of the counters
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'timeouts': self.timeouts,
+            }
@@ -0,0 +1,14 @@
+import mimetypes
+import os
+import sys
+
+from compression import precompress_folder
+
+# Write the gzip and brotli variants of the static files, served directly
+# by the application to the clients accepting them.
+# Run it as part of the build, after any change to the static files.
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'static')
+    for path in precompress_folder(folder, mimetypes):
+        print(path)
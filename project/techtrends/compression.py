@@ -0,0 +1,84 @@
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Content types worth compressing
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/xml', 'image/svg+xml')
+
+# File extension of the pre-compressed variant of a file, per encoding
+EXTENSIONS = {'br': '.br', 'gzip': '.gz'}
+
+
+# Encodings this process can produce, preferred first
+def available_encodings():
+    if brotli is not None:
+        return ('br', 'gzip')
+    return ('gzip',)
+
+
+# Pick the preferred encoding accepted by the client, or None
+def choose_encoding(accept_encodings, encodings=None):
+    for encoding in encodings or available_encodings():
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+# Whether a response of `mimetype` is worth compressing
+def is_compressible(mimetype):
+    return mimetype is not None and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+# Compress `data` with `encoding`
+def compress(data, encoding, level=None):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5 if level is None else level)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6 if level is None else level)
+    raise ValueError('unsupported encoding: %r' % encoding)
+
+
+# Short hash of the content of a file, used to version static URLs
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+# Write the pre-compressed variants of every compressible file under
+# `folder`, at the highest compression levels, next to the original file.
+# Variants that are not smaller than the original are not written.
+# Returns the paths of the written files.
+def precompress_folder(folder, mimetypes):
+    written = []
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            if name.endswith(tuple(EXTENSIONS.values())):
+                continue
+            mimetype, _ = mimetypes.guess_type(name)
+            if not is_compressible(mimetype):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            for encoding in available_encodings():
+                level = 11 if encoding == 'br' else 9
+                compressed = compress(data, encoding, level)
+                target = path + EXTENSIONS[encoding]
+                if len(compressed) >= len(data):
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written.append(target)
+    return written
@@ -0,0 +1,61 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+
+
+# Hash of every file under `folder`.
+# It is part of the ETags, so that a deployment changing the templates
+# invalidates the pages cached by clients.
+def folder_version(folder):
+    digest = hashlib.sha1()
+    for root, dirs, files in sorted(os.walk(folder)):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, folder).encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+# Build an ETag value from the parts a page depends on
+def make_etag(*parts):
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+# Parse a `created` timestamp of SQLite, stored in UTC
+def parse_timestamp(value):
+    if value is None:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+# Whether the client already holds the current version of a page.
+# If-None-Match takes precedence over If-Modified-Since, as in RFC 7232
+def is_not_modified(request, etag, last_modified=None):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        since = request.if_modified_since
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+# Set the validators and the caching policy of a response
+def set_cache_headers(response, etag, last_modified=None, max_age=0):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
+
+
+# Build the 304 response telling the client to reuse its copy of a page
+def not_modified_response(response_class, etag, last_modified=None, max_age=0):
+    return set_cache_headers(response_class(status=304), etag, last_modified, max_age)
@@ -0,0 +1,54 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from load_posts import connect
+
+# The application reads its settings when it is imported: give it a
+# database of its own, created from the schema, before any test imports it
+TEST_DIR = tempfile.mkdtemp(prefix='techtrends-test-')
+os.environ['TECHTRENDS_DATABASE'] = os.path.join(TEST_DIR, 'database.db')
+os.environ['TECHTRENDS_ADMIN_TOKEN'] = 'secret'
+os.environ['TECHTRENDS_WARM_UP'] = '0'
+os.environ['TECHTRENDS_LOG_ACCESS'] = '0'
+os.environ['TECHTRENDS_LOG_FILE'] = os.path.join(TEST_DIR, 'techtrends.log')
+os.environ['TECHTRENDS_TEMPLATE_CACHE_DIR'] = ''
+os.environ['TECHTRENDS_PROFILING_DIR'] = os.path.join(TEST_DIR, 'profiles')
+
+connection = connect(os.environ['TECHTRENDS_DATABASE'])
+with open(os.path.join(HERE, 'schema.sql')) as f:
+    connection.executescript(f.read())
+connection.close()
+
+# Imported here, ahead of the other folders named on `sys.path` by pytest
+# that have an `app` module of their own
+import app as techtrends
+
+
+# Write the view counts left by the tests before the database is removed
+def pytest_unconfigure(config):
+    techtrends.post_views.flush()
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def client():
+    return techtrends.app.test_client()
+
+
+# Create posts through the bulk API; returns their IDs
+@pytest.fixture
+def create_posts(client):
+    def create(count, prefix='Post'):
+        response = client.post('/api/posts/bulk', json=[
+            {'title': '%s %d' % (prefix, number), 'content': 'cloud native %d' % number}
+            for number in range(count)])
+        assert response.status_code == 201
+        return [result['id'] for result in response.get_json()['results']]
+    return create
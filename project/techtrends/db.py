@@ -0,0 +1,589 @@
+import bisect
+import collections
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+
+logger = logging.getLogger('techtrends.db')
+
+
+# A connection that reports the duration of every statement it executes.
+# `observer`, when set, is called with the connection, the SQL text, its
+# parameters (None for `executemany` and `executescript`) and the elapsed
+# seconds. Only the time spent in `execute` is measured; for queries
+# returning many rows the time spent fetching them afterwards is not included.
+class TimedConnection(sqlite3.Connection):
+    observer = None
+
+    def _timed(self, method, sql, parameters, *args):
+        observer = self.observer
+        if observer is None:
+            return method(sql, *args)
+        start = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            observer(self, sql, parameters, time.perf_counter() - start)
+
+    def execute(self, sql, *args):
+        return self._timed(super().execute, sql, args[0] if args else (), *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(super().executemany, sql, None, *args)
+
+    def executescript(self, sql):
+        return self._timed(super().executescript, sql, None)
+
+
+# Patterns replaced to normalize the text of a statement
+NORMALIZE_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?, ...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+# Normalize the text of a statement, so that statements differing only by
+# their literal values or by the length of their IN lists are counted together
+def normalize_sql(sql):
+    normalized = _normalized.get(sql)
+    if normalized is None:
+        normalized = sql
+        for pattern, replacement in NORMALIZE_PATTERNS:
+            normalized = pattern.sub(replacement, normalized)
+        normalized = normalized.strip()
+        if len(_normalized) >= 1024:
+            _normalized.clear()
+        _normalized[sql] = normalized
+    return normalized
+
+# Normalized texts of the statements seen recently
+_normalized = {}
+
+
+# Statements EXPLAIN QUERY PLAN applies to
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+# Upper bounds of the duration histogram of each statement, in seconds
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+# Per-statement timing statistics and slow query log.
+# Statements are aggregated by their normalized text: count, total, maximum
+# and a duration histogram. Statements slower than `slow_threshold` seconds
+# are logged with their query plan, and the latest of them are kept.
+# The query plan of a statement is only computed the first time it is slow.
+class QueryStats:
+    def __init__(self, slow_threshold=0.05, keep_slow=100):
+        self.slow_threshold = slow_threshold
+        self.slow_queries = collections.deque(maxlen=keep_slow)
+        self._stats = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    # Record a statement; suited as the observer of a `TimedConnection`
+    def observe(self, connection, sql, parameters, seconds):
+        normalized = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(normalized)
+            if stats is None:
+                stats = self._stats[normalized] = {
+                    'count': 0, 'total': 0.0, 'max': 0.0,
+                    'buckets': [0] * (len(QUERY_BUCKETS) + 1)}
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['buckets'][bisect.bisect_left(QUERY_BUCKETS, seconds)] += 1
+        if seconds >= self.slow_threshold:
+            self.log_slow_query(connection, sql, normalized, parameters, seconds)
+
+    def log_slow_query(self, connection, sql, normalized, parameters, seconds):
+        plan = self._plans.get(normalized)
+        if plan is None and parameters is not None:
+            plan = self.explain(connection, sql, parameters)
+            self._plans[normalized] = plan
+        entry = {'sql': normalized, 'duration_ms': round(seconds * 1000, 3),
+                 'plan': plan, 'time': time.time()}
+        self.slow_queries.append(entry)
+        logger.warning('slow query (%.1f ms): %s; plan: %s', seconds * 1000, normalized,
+                       ' | '.join(plan or ()))
+
+    # The query plan of a statement, one line per step.
+    # It runs on the connection that executed the statement, bypassing
+    # the timing so that it is not recorded itself.
+    def explain(self, connection, sql, parameters):
+        if sql.lstrip().split(None, 1)[0].upper() not in EXPLAINABLE:
+            return []
+        try:
+            rows = sqlite3.Connection.execute(connection, 'EXPLAIN QUERY PLAN ' + sql,
+                                              parameters).fetchall()
+        except sqlite3.Error:
+            return []
+        return [row[-1] for row in rows]
+
+    # Statistics of every statement, slowest in total first
+    def snapshot(self):
+        with self._lock:
+            items = [(sql, dict(stats, buckets=list(stats['buckets'])))
+                     for sql, stats in self._stats.items()]
+        result = []
+        for sql, stats in sorted(items, key=lambda item: item[1]['total'], reverse=True):
+            histogram = dict(zip([str(bound) for bound in QUERY_BUCKETS] + ['+Inf'],
+                                 stats['buckets']))
+            result.append({
+                'sql': sql,
+                'count': stats['count'],
+                'total_ms': round(stats['total'] * 1000, 3),
+                'mean_ms': round(stats['total'] * 1000 / stats['count'], 3),
+                'max_ms': round(stats['max'] * 1000, 3),
+                'histogram': histogram,
+            })
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+        self.slow_queries.clear()
+
+
+# Default connection settings.
+# In WAL mode readers no longer wait for writers and a commit only appends
+# to the log; with `synchronous=NORMAL` the log is synced at checkpoints
+# rather than on every commit, which is safe against corruption in WAL mode
+# but may lose the last transactions on a power failure.
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),
+    ('mmap_size', 268435456),
+    ('busy_timeout', 5000),
+)
+
+
+# Apply `pragmas`, a sequence of (name, value) pairs, to a connection
+def configure_connection(connection, pragmas):
+    for name, value in pragmas:
+        connection.execute('PRAGMA %s = %s' % (name, value)).fetchall()
+
+
+# Raised when no pooled connection becomes available within the timeout
+class PoolTimeout(Exception):
+    pass
+
+
+# A bounded pool of SQLite connections.
+# Idle connections are handed out last-in first-out, so a busy worker keeps
+# reusing the same warm connection. A thread that already holds a connection
+# gets that same connection back, which keeps nested lookups within one
+# request on a single connection. At most `max_size` connections are open.
+class ConnectionPool:
+    def __init__(self, database, max_size=8, timeout=5.0, recheck_after=30.0,
+                 observer=None, pragmas=DEFAULT_PRAGMAS):
+        self.database = database
+        self.observer = observer
+        self.pragmas = pragmas
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recheck_after = recheck_after
+        self._idle = []
+        self._open = 0
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._local = threading.local()
+
+    # Open a new configured connection; it may be used from any thread,
+    # but the pool makes sure only one thread holds it at a time
+    def connect(self):
+        connection = sqlite3.connect(self.database, check_same_thread=False,
+                                     factory=TimedConnection)
+        connection.row_factory = sqlite3.Row
+        configure_connection(connection, self.pragmas)
+        connection.observer = self.observer
+        return connection
+
+    # Cheap liveness check for connections that sat idle for a while
+    def _is_healthy(self, connection, idle_since):
+        if time.monotonic() - idle_since < self.recheck_after:
+            return True
+        try:
+            sqlite3.Connection.execute(connection, 'SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    # Get a connection for the current thread, waiting at most `timeout`
+    # seconds, or the pool timeout, for one to be available
+    def acquire(self, timeout=None):
+        held = getattr(self._local, 'connection', None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            connection = None
+            idle_since = None
+            with self._condition:
+                while not self._idle and self._open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout('no database connection available '
+                                          'after %.1fs' % timeout)
+                    self._condition.wait(remaining)
+                if self._idle:
+                    connection, idle_since = self._idle.pop()
+                else:
+                    self._open += 1
+            if connection is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    with self._condition:
+                        self._open -= 1
+                        self._condition.notify()
+                    raise
+            elif not self._is_healthy(connection, idle_since):
+                self._discard(connection)
+                continue
+            break
+
+        with self._condition:
+            self._in_use += 1
+        self._local.connection = connection
+        self._local.depth = 1
+        return connection
+
+    # Give the current thread's connection back to the pool.
+    # Any transaction left open by the caller is rolled back so the next
+    # user starts from a clean state.
+    def release(self, connection):
+        if getattr(self._local, 'connection', None) is not connection:
+            raise ValueError('connection is not held by this thread')
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.connection = None
+        with self._condition:
+            self._in_use -= 1
+
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.Error:
+            self._discard(connection)
+            return
+
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    # Close every idle connection, e.g. before a worker process exits
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for connection, _ in idle:
+            connection.close()
+
+    # Snapshot of the pool usage
+    def stats(self):
+        with self._condition:
+            return {
+                'max_size': self.max_size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+            }
+
+
+# Group commit of writes.
+# Statements submitted from concurrent requests are queued and executed by a
+# single writer thread, which runs every statement waiting in the queue, up
+# to `max_batch`, in one transaction. One commit, and one sync of the log,
+# is then shared by the whole batch. Each statement runs in its own
+# savepoint, so a failing statement does not fail the rest of its batch.
+# The writer thread is started on the first submit, i.e. after the process
+# forked its workers.
+class GroupCommitWriter:
+    def __init__(self, connect, max_batch=256, max_delay=0.002):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # Queue a statement; returns a future resolved with the row id of the
+    # inserted row once the transaction holding the statement committed
+    def submit(self, sql, parameters=()):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((sql, parameters, future))
+        return future
+
+    # Run a statement through the writer and wait for its commit
+    def execute(self, sql, parameters=(), timeout=None):
+        return self.submit(sql, parameters).result(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='group-commit-writer',
+                                                daemon=True)
+                self._thread.start()
+
+    # Collect the statements waiting in the queue, waiting up to `max_delay`
+    # for more to arrive once the first one is there
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        connection = None
+        while True:
+            batch = self._next_batch()
+            results = []
+            try:
+                if connection is None:
+                    connection = self.connect()
+                connection.execute('BEGIN IMMEDIATE')
+                for sql, parameters, future in batch:
+                    connection.execute('SAVEPOINT item')
+                    try:
+                        cursor = connection.execute(sql, parameters)
+                    except Exception as error:
+                        connection.execute('ROLLBACK TO item')
+                        results.append((future, None, error))
+                    else:
+                        results.append((future, cursor.lastrowid, None))
+                    connection.execute('RELEASE item')
+                connection.execute('COMMIT')
+            except Exception as error:
+                # The statements of the batch fail together; a connection
+                # that cannot roll back is replaced for the next batch
+                if connection is not None:
+                    try:
+                        if connection.in_transaction:
+                            connection.rollback()
+                    except Exception:
+                        connection.close()
+                        connection = None
+                for sql, parameters, future in batch:
+                    future.set_exception(error)
+                continue
+            for future, row_id, error in results:
+                if error is None:
+                    future.set_result(row_id)
+                else:
+                    future.set_exception(error)
+
+
+# Object kept in the thread-local data of a thread owning a shard; it is
+# dropped with that data when the thread ends
+class _ShardOwner:
+    pass
+
+
+# Counts of events per key, e.g. views per post, written behind to the
+# database. Increments are added up in memory, in a shard owned by the
+# calling thread, and a background thread writes the sums every `interval`
+# seconds, or as soon as a shard holds `max_pending` keys, in a single
+# transaction running `sql` with (key, amount) parameters for each key.
+# Counts that failed to be written are kept for the next flush. A crash
+# loses at most the counts of the last interval. The shard of a finished
+# thread is moved to the counts of the next flush. Counts move between the
+# shards, the flush and the retries under a lock also held by the commit of
+# a flush, so that `totals` sees each count exactly once.
+class WriteBehindCounter:
+    def __init__(self, connect, sql, interval=5.0, max_pending=10000):
+        self.connect = connect
+        self.sql = sql
+        self.interval = interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self.flushed = 0
+        self.failures = 0
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Counts of the parent are flushed by the parent
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._shards = {}
+        self._shards_lock = threading.RLock()
+        self._local = threading.local()
+        self._orphans = {}
+        self._retry = {}
+        self._flushing = {}
+        self._state_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    # Get the [lock, counts] shard of the calling thread; its lock is only
+    # contended while the shard is being flushed
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = [threading.Lock(), {}]
+            owner = self._local.owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards[id(shard)] = shard
+            weakref.finalize(owner, self._retire, shard).atexit = False
+            return shard
+
+    # Move the counts of the shard of a finished thread to the orphan counts
+    def _retire(self, shard):
+        with self._shards_lock:
+            if self._shards.pop(id(shard), None) is None:
+                # Shard of the parent of a forked process
+                return
+            with shard[0]:
+                counts, shard[1] = shard[1], {}
+            for key, amount in counts.items():
+                self._orphans[key] = self._orphans.get(key, 0) + amount
+
+    def inc(self, key, amount=1):
+        shard = self._shard()
+        with shard[0]:
+            counts = shard[1]
+            counts[key] = counts.get(key, 0) + amount
+            size = len(counts)
+        if self._thread is None or not self._thread.is_alive():
+            self._ensure_started()
+        if size >= self.max_pending:
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-behind-counter',
+                                                daemon=True)
+                self._thread.start()
+
+    # Counts of `key` not written to the database yet
+    def pending(self, key):
+        with self._state_lock:
+            return self._pending(key)
+
+    def _pending(self, key):
+        total = self._retry.get(key, 0) + self._flushing.get(key, 0)
+        with self._shards_lock:
+            shards = list(self._shards.values())
+            total += self._orphans.get(key, 0)
+        for shard in shards:
+            with shard[0]:
+                total += shard[1].get(key, 0)
+        return total
+
+    # Total counts of `keys`: the counts written, as returned by
+    # `read_written(keys)` in a dict, plus the pending ones. No flush commits
+    # while they are read.
+    def totals(self, keys, read_written):
+        with self._state_lock:
+            totals = read_written(keys)
+            for key in keys:
+                totals[key] = totals.get(key, 0) + self._pending(key)
+        return totals
+
+    # Move the counts of every shard, and the counts to retry, to the
+    # counts being flushed
+    def _collect(self):
+        with self._state_lock:
+            with self._shards_lock:
+                shards = list(self._shards.values())
+                orphans, self._orphans = self._orphans, {}
+            totals, self._retry = self._retry, {}
+            for key, amount in orphans.items():
+                totals[key] = totals.get(key, 0) + amount
+            for shard in shards:
+                with shard[0]:
+                    counts, shard[1] = shard[1], {}
+                for key, amount in counts.items():
+                    totals[key] = totals.get(key, 0) + amount
+            self._flushing = totals
+        return totals
+
+    # Write the pending counts in one transaction.
+    # Returns the number of keys written.
+    def flush(self):
+        with self._flush_lock:
+            counts = self._collect()
+            if not counts:
+                return 0
+            try:
+                connection = self.connect()
+                try:
+                    connection.execute('BEGIN IMMEDIATE')
+                    connection.executemany(self.sql, list(counts.items()))
+                    with self._state_lock:
+                        connection.execute('COMMIT')
+                        self._flushing = {}
+                finally:
+                    connection.close()
+            except sqlite3.Error as e:
+                self.failures += 1
+                with self._state_lock:
+                    self._flushing = {}
+                    for key, amount in counts.items():
+                        self._retry[key] = self._retry.get(key, 0) + amount
+                logger.warning('could not write %d counts, retrying later: %s', len(counts), e)
+                return 0
+            self.flushes += 1
+            self.flushed += len(counts)
+            return len(counts)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stats(self):
+        with self._shards_lock:
+            shards = list(self._shards.values())
+            pending = len(self._orphans)
+        with self._state_lock:
+            pending += len(self._retry)
+        for shard in shards:
+            with shard[0]:
+                pending += len(shard[1])
+        return {
+            'pending_keys': pending,
+            'flushes': self.flushes,
+            'flushed_keys': self.flushed,
+            'failures': self.failures,
+        }
@@ -0,0 +1,196 @@
+import argparse
+import glob
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from flask import render_template
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# State of the last export, written in the output folder
+MANIFEST = '.export.json'
+
+# Version of the layout of the exported files, recorded in the manifest
+LAYOUT = 2
+
+
+# Write `data` to `path` through a temporary file, so that a server reading
+# the folder never sees a partially written file
+def write_file(path, data):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=folder, prefix='.export-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def load_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# File name and URL of a listing page.
+# Pages are numbered from the oldest posts, so that a page keeps its posts
+# when newer posts are created; only the last page, with the newest posts,
+# may be partly filled.
+def page_file(number):
+    return 'page-%d.html' % number
+
+
+def page_url(number):
+    return '/page-%d' % number
+
+
+# Render the listing pages from `first` to the last one.
+# Returns the number of rendered pages.
+def export_pages(folder, connection, render, first, per_page, pages):
+    rows = connection.execute(
+        'SELECT id, created, title FROM posts ORDER BY created, id LIMIT -1 OFFSET ?',
+        ((first - 1) * per_page,))
+    for number in range(first, pages + 1):
+        posts = list(itertools.islice(rows, per_page))
+        posts.reverse()
+        page = render('index.html', posts=posts, cursor=None, next_cursor=None,
+                      limit=per_page,
+                      older_url=page_url(number - 1) if number > 1 else None,
+                      newer_url=page_url(number + 1) if number < pages else None)
+        write_file(os.path.join(folder, page_file(number)), page)
+    return pages - first + 1
+
+
+# Render the main page with the newest `per_page` posts, out of `count`.
+# Unless the posts fill the listing pages exactly, it overlaps the last two
+# pages; it links to the page of the newest post it does not show.
+def export_index(folder, connection, render, per_page, count):
+    posts = connection.execute(
+        'SELECT id, created, title FROM posts ORDER BY created DESC, id DESC LIMIT ?',
+        (per_page,)).fetchall()
+    older = count - len(posts)
+    page = render('index.html', posts=posts, cursor=None, next_cursor=None, limit=per_page,
+                  older_url=page_url(-(-older // per_page)) if older > 0 else None,
+                  newer_url=None)
+    write_file(os.path.join(folder, 'index.html'), page)
+
+
+# Render the page of every post created after `after_id`.
+# Returns the number of rendered posts.
+def export_posts(folder, connection, render, after_id):
+    count = 0
+    for post in connection.execute('SELECT * FROM posts WHERE id > ? ORDER BY id', (after_id,)):
+        write_file(os.path.join(folder, '%d.html' % post['id']), render('post.html', post=post))
+        count += 1
+    return count
+
+
+# Export the site of `app` into `folder`: the listing pages, the pages of
+# the posts, the about and 404 pages and the static files.
+# The state of the export is kept in the folder. A later export only
+# renders the posts created since, the main page and the listing pages they
+# changed, unless `full` is set, the templates, static files or page size
+# changed, or posts were created with an older creation time than the
+# exported ones.
+# Returns a summary of the export.
+def export_site(app, connection, version, folder, per_page, full=False):
+    count, last_id = connection.execute('SELECT COUNT(*), MAX(id) FROM posts').fetchone()
+    last_id = last_id or 0
+    newest = connection.execute(
+        'SELECT created, id FROM posts ORDER BY created DESC, id DESC LIMIT 1').fetchone()
+    pages = max(1, -(-count // per_page))
+
+    manifest = load_manifest(folder)
+    incremental = (not full and manifest is not None
+                   and manifest.get('layout') == LAYOUT
+                   and manifest.get('version') == version
+                   and manifest.get('per_page') == per_page
+                   and manifest.get('last_id', 0) <= last_id)
+    if incremental and manifest['newest'] is not None:
+        created, post_id = manifest['newest']
+        incremental = connection.execute(
+            'SELECT 1 FROM posts WHERE id > ? AND (created, id) < (?, ?) LIMIT 1',
+            (manifest['last_id'], created, post_id)).fetchone() is None
+
+    if incremental:
+        # The previous last page gets new posts, or a link to the next page
+        after_id = manifest['last_id']
+        first = manifest['pages'] if last_id > after_id else None
+    else:
+        after_id = 0
+        first = 1
+
+    with app.test_request_context('/'):
+        rendered_pages = 0
+        if first is not None:
+            rendered_pages = export_pages(folder, connection, render_template, first,
+                                          per_page, pages)
+            export_index(folder, connection, render_template, per_page, count)
+            rendered_pages += 1
+        rendered_posts = export_posts(folder, connection, render_template, after_id)
+        write_file(os.path.join(folder, 'about.html'), render_template('about.html'))
+        write_file(os.path.join(folder, '404.html'), render_template('404.html'))
+
+    shutil.copytree(app.static_folder, os.path.join(folder, 'static'), dirs_exist_ok=True)
+    if not incremental:
+        # Listing pages left over from an export of more posts
+        for path in glob.glob(os.path.join(folder, 'page-*.html')):
+            number = os.path.basename(path)[5:-5]
+            if not number.isdigit() or int(number) > pages:
+                os.remove(path)
+
+    write_file(os.path.join(folder, MANIFEST), json.dumps({
+        'layout': LAYOUT,
+        'version': version,
+        'per_page': per_page,
+        'pages': pages,
+        'count': count,
+        'last_id': last_id,
+        'newest': [newest['created'], newest['id']] if newest is not None else None,
+    }, indent=2, sort_keys=True))
+    return {'incremental': incremental, 'posts': rendered_posts, 'pages': rendered_pages}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Export TechTrends as a static site.')
+    parser.add_argument('--output', default='site', help='folder the site is written to')
+    parser.add_argument('--database', help='path to the SQLite database')
+    parser.add_argument('--per-page', type=int, help='posts per listing page')
+    parser.add_argument('--full', action='store_true',
+                        help='render every page, instead of the pages of the new posts')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.database:
+        os.environ['TECHTRENDS_DATABASE'] = args.database
+    sys.path.insert(0, HERE)
+    from app import app, pool, template_version
+
+    per_page = args.per_page or app.config['POSTS_PER_PAGE']
+    start = time.perf_counter()
+    connection = pool.acquire()
+    try:
+        summary = export_site(app, connection, template_version, args.output, per_page,
+                              args.full)
+    finally:
+        pool.release(connection)
+    print('%s export of %d posts and %d listing pages to %s in %.2fs'
+          % ('Incremental' if summary['incremental'] else 'Full', summary['posts'],
+             summary['pages'], args.output, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
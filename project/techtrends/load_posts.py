@@ -0,0 +1,202 @@
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import random
+import sqlite3
+import sys
+import time
+
+# Settings for bulk loads: no sync of the database file until the end,
+# and a large page cache with temporary data kept in memory.
+# A crash during the load may leave the database corrupted.
+BULK_PRAGMAS = (
+    ('synchronous', 'OFF'),
+    ('cache_size', -262144),
+    ('temp_store', 'MEMORY'),
+)
+
+INSERT_SQL = ('INSERT INTO posts (created, title, content) '
+              'VALUES (COALESCE(datetime(?), CURRENT_TIMESTAMP), ?, ?)')
+
+WORDS = ('cloud', 'native', 'kubernetes', 'container', 'cluster', 'pod', 'service',
+         'helm', 'chart', 'argocd', 'deployment', 'release', 'operator', 'mesh',
+         'observability', 'prometheus', 'scaling', 'pipeline', 'gitops', 'registry')
+
+
+# Convert an ISO 8601 creation time, e.g. `2030-01-01T10:00:00Z`, to the
+# UTC `YYYY-MM-DD HH:MM:SS` format of CURRENT_TIMESTAMP, which the pages
+# and the order of the listing rely on. Times without an offset are UTC.
+def parse_created(value):
+    text = str(value)
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    try:
+        created = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError('invalid creation time: %r' % (value,))
+    if created.tzinfo is not None:
+        created = created.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return created.isoformat(' ', 'seconds')
+
+
+# Convert a post read from a file to a (created, title, content) row
+def to_row(post):
+    title = post.get('title')
+    if not title:
+        raise ValueError('post without a title: %r' % (post,))
+    created = post.get('created')
+    return parse_created(created) if created else None, title, post.get('content') or ''
+
+
+# Read posts from a JSON lines file, one object per line
+def read_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield to_row(json.loads(line))
+
+
+# Read posts from a CSV file with a header row naming the
+# `title`, `content` and optional `created` columns
+def read_csv(f):
+    for post in csv.DictReader(f):
+        yield to_row(post)
+
+
+# Generate `count` synthetic posts
+def generate_posts(count, seed=0):
+    rng = random.Random(seed)
+    for number in range(1, count + 1):
+        title = '%s %d' % (' '.join(rng.choice(WORDS) for _ in range(4)).capitalize(), number)
+        content = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 200)))
+        yield None, title, content
+
+
+# Drop the indexes and triggers of the posts table, so that they are built
+# once after the load instead of being updated row by row.
+# Returns their definitions, for `restore_indexes`.
+def drop_indexes(connection):
+    definitions = connection.execute(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE tbl_name = 'posts' AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+    ).fetchall()
+    for kind, name, sql in definitions:
+        connection.execute('DROP %s %s' % (kind.upper(), name))
+    return definitions
+
+
+# Create the indexes and triggers dropped by `drop_indexes` again, and
+# rebuild the full-text index and the statistics the dropped triggers kept
+# in sync
+def restore_indexes(connection, definitions):
+    for kind, name, sql in definitions:
+        connection.execute(sql)
+    if not any(kind == 'trigger' for kind, name, sql in definitions):
+        return
+    tables = {name for name, in connection.execute(
+        "SELECT name FROM sqlite_master WHERE name IN ('posts_fts', 'post_stats')")}
+    if 'posts_fts' in tables:
+        connection.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+    if 'post_stats' in tables:
+        connection.execute(
+            'UPDATE post_stats SET post_count = (SELECT COUNT(*) FROM posts), '
+            'content_bytes = (SELECT COALESCE(SUM(length(CAST(content AS BLOB))), 0) FROM posts), '
+            'newest_created = (SELECT MAX(created) FROM posts) WHERE id = 1')
+
+
+# Insert `rows` of (created, title, content) into the posts table.
+# With `defer_indexes`, the whole load runs in one transaction and the
+# indexes are built at the end; otherwise the indexes are kept up to date
+# and every batch of `batch_size` rows is committed. By default indexes are
+# deferred when the table is empty, as rebuilding the full-text index of a
+# large table costs more than updating it for a few rows.
+# Returns the number of inserted rows.
+def load_posts(connection, rows, batch_size=50000, defer_indexes=None):
+    rows = iter(rows)
+    count = 0
+    definitions = []
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        if defer_indexes is None:
+            defer_indexes = connection.execute('SELECT 1 FROM posts LIMIT 1').fetchone() is None
+        if defer_indexes:
+            definitions = drop_indexes(connection)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            connection.executemany(INSERT_SQL, batch)
+            count += len(batch)
+            if not defer_indexes:
+                connection.commit()
+                connection.execute('BEGIN IMMEDIATE')
+        if defer_indexes:
+            restore_indexes(connection, definitions)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return count
+
+
+# Open a database configured for a bulk load
+def connect(database):
+    connection = sqlite3.connect(database)
+    for name, value in BULK_PRAGMAS:
+        connection.execute('PRAGMA %s = %s' % (name, value))
+    return connection
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Bulk load posts into the TechTrends database.')
+    parser.add_argument('--database', default='database.db', help='path to the SQLite database')
+    parser.add_argument('--init', action='store_true',
+                        help='create the tables from schema.sql first, deleting existing posts')
+    parser.add_argument('--schema', default='schema.sql', help='path to the schema used by --init')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--jsonl', metavar='FILE', help='load posts from a JSON lines file')
+    source.add_argument('--csv', metavar='FILE', help='load posts from a CSV file')
+    source.add_argument('--generate', metavar='N', type=int, help='generate N synthetic posts')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of --generate')
+    parser.add_argument('--batch-size', type=int, default=50000,
+                        help='rows inserted per executemany call')
+    parser.add_argument('--defer-indexes', choices=('auto', 'always', 'never'), default='auto',
+                        help='build the indexes after the load instead of updating them '
+                             'row by row; auto defers them when the table is empty')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    connection = connect(args.database)
+    if args.init:
+        with open(args.schema) as f:
+            connection.executescript(f.read())
+
+    source = None
+    if args.jsonl:
+        source = open(args.jsonl, encoding='utf-8')
+        rows = read_jsonl(source)
+    elif args.csv:
+        source = open(args.csv, encoding='utf-8', newline='')
+        rows = read_csv(source)
+    else:
+        rows = generate_posts(args.generate, args.seed)
+
+    start = time.perf_counter()
+    try:
+        defer_indexes = {'auto': None, 'always': True, 'never': False}[args.defer_indexes]
+        count = load_posts(connection, rows, args.batch_size, defer_indexes)
+    finally:
+        if source is not None:
+            source.close()
+        connection.close()
+    elapsed = time.perf_counter() - start
+    print('Loaded %d posts in %.2fs (%.0f rows/s)'
+          % (count, elapsed, count / elapsed if elapsed > 0 else 0))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,239 @@
+import cProfile
+import collections
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from jinja2 import Template
+
+# Profile of the request handled by the current thread, if it is profiled
+_local = threading.local()
+
+
+# Add time spent in the database to the profiled request of this thread
+def add_db_time(seconds):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.db_time += seconds
+
+
+# Add time spent rendering templates to the profiled request of this thread
+def add_render_time(seconds):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.render_time += seconds
+
+
+# A template that reports the time spent rendering it.
+# Set it as the `template_class` of the Jinja environment.
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        if getattr(_local, 'profile', None) is None:
+            return Template.render(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            add_render_time(time.perf_counter() - start)
+
+
+# Profile of one request: a cProfile of the request thread, the stacks
+# sampled by the `StackSampler`, and the time spent in the database and
+# in template rendering
+class RequestProfile:
+    def __init__(self, name):
+        self.name = name
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.stacks = collections.Counter()
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Only one cProfile may run at a time on some Python versions;
+            # the request is then profiled by sampling only
+            self.profile = None
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+        return time.perf_counter() - self.start
+
+
+# Format the stack of `frame` as a line of the folded format read by
+# flame graph tools, from the outermost call to the innermost one
+def fold_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# Samples the stacks of the threads running a profiled request.
+# The sampling thread stops when no request is profiled, and is started
+# again by the next one.
+class StackSampler:
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles[profile.thread_id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler',
+                                                daemon=True)
+                self._thread.start()
+
+    def remove(self, profile):
+        with self._lock:
+            self._profiles.pop(profile.thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                profiles = list(self._profiles.values())
+                if not profiles:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.stacks[fold_stack(frame)] += 1
+
+
+# Opt-in profiling of requests.
+# When enabled, a `sample_rate` fraction of the requests is profiled;
+# a request can also be profiled on demand. For each profiled request the
+# profiler writes, in `output_dir`, the cProfile statistics (`.prof`, for
+# pstats or snakeviz) and the sampled stacks (`.folded`, for flamegraph.pl
+# or speedscope), and keeps a summary of the time spent in the database,
+# in template rendering and in total. Only the files and summaries of the
+# `keep` latest profiles are kept. Profiles show the code and data of the
+# requests, so `output_dir` is created readable by its owner only; without
+# one, a private folder is created in the temporary directory on first use.
+class Profiler:
+    def __init__(self, output_dir=None, enabled=False, sample_rate=0.0,
+                 sample_interval=0.001, keep=100):
+        self.output_dir = output_dir
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.sampler = StackSampler(sample_interval)
+        self.summaries = collections.deque(maxlen=keep)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._files_lock = threading.Lock()
+
+    # Whether the next request should be profiled
+    def should_profile(self, forced=False):
+        if forced:
+            return True
+        return self.enabled and self.sample_rate > 0 and random.random() < self.sample_rate
+
+    # Start profiling the request handled by the current thread
+    def start(self):
+        with self._lock:
+            self._count += 1
+            name = '%d-%d-%d' % (int(time.time()), os.getpid(), self._count)
+        profile = RequestProfile(name)
+        _local.profile = profile
+        self.sampler.add(profile)
+        return profile
+
+    # Stop profiling a request and write its profile.
+    # Returns the summary of the request.
+    def stop(self, profile, method, path, status):
+        total = profile.stop()
+        _local.profile = None
+        self.sampler.remove(profile)
+        summary = {
+            'name': profile.name,
+            'method': method,
+            'path': path,
+            'status': status,
+            'total_ms': round(total * 1000, 3),
+            'db_ms': round(profile.db_time * 1000, 3),
+            'render_ms': round(profile.render_time * 1000, 3),
+            'samples': sum(profile.stacks.values()),
+        }
+        with self._files_lock:
+            folder = self._folder()
+            base = os.path.join(folder, profile.name)
+            if profile.profile is not None:
+                profile.profile.dump_stats(base + '.prof')
+                summary['profile'] = profile.name + '.prof'
+            if profile.stacks:
+                with open(base + '.folded', 'w') as f:
+                    for stack, count in profile.stacks.most_common():
+                        f.write('%s %d\n' % (stack, count))
+                summary['stacks'] = profile.name + '.folded'
+            with open(os.path.join(folder, 'profiles.jsonl'), 'a') as f:
+                f.write(json.dumps(summary, sort_keys=True) + '\n')
+            self._prune(folder)
+        self.summaries.append(summary)
+        return summary
+
+    # Get the folder of the profiles, creating it if needed
+    def _folder(self):
+        if self.output_dir is None:
+            self.output_dir = tempfile.mkdtemp(prefix='techtrends-profiles-')
+        else:
+            os.makedirs(self.output_dir, mode=0o700, exist_ok=True)
+        return self.output_dir
+
+    # Remove the files of the profiles older than the `keep` latest ones,
+    # which may have been written by other processes sharing the folder,
+    # and their summaries from `profiles.jsonl`
+    def _prune(self, folder):
+        files = {}
+        for name in os.listdir(folder):
+            stem, extension = os.path.splitext(name)
+            if extension in ('.prof', '.folded'):
+                try:
+                    modified = os.path.getmtime(os.path.join(folder, name))
+                except OSError:
+                    continue
+                files.setdefault(stem, []).append((modified, name))
+        latest = sorted(files, key=lambda stem: max(files[stem]), reverse=True)
+        for stem in latest[self.keep:]:
+            for modified, name in files[stem]:
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+
+        path = os.path.join(folder, 'profiles.jsonl')
+        with open(path) as f:
+            lines = f.readlines()
+        if len(lines) > self.keep:
+            temporary = '%s.%d' % (path, os.getpid())
+            with open(temporary, 'w') as f:
+                f.writelines(lines[-self.keep:])
+            os.replace(temporary, path)
+
+    # Abandon the profile of a request that failed before `stop`
+    def discard(self, profile):
+        profile.stop()
+        _local.profile = None
+        self.sampler.remove(profile)
+
+    def state(self):
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'output_dir': self.output_dir,
+            'recent': list(self.summaries),
+        }
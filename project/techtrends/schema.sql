@@ -1,3 +1,6 @@
+DROP TABLE IF EXISTS post_views;
+DROP TABLE IF EXISTS post_stats;
+DROP TABLE IF EXISTS posts_fts;
 DROP TABLE IF EXISTS posts;
 
 CREATE TABLE posts (
@@ -6,3 +9,75 @@ CREATE TABLE posts (
     title TEXT NOT NULL,
     content TEXT NOT NULL
 );
+
+CREATE INDEX posts_created_id ON posts (created, id);
+
+-- Full-text index of the posts, kept in sync by the triggers below
+CREATE VIRTUAL TABLE posts_fts USING fts5(
+    title,
+    content,
+    content='posts',
+    content_rowid='id'
+);
+
+CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_fts (rowid, title, content)
+    VALUES (new.id, new.title, new.content);
+END;
+
+CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title, content)
+    VALUES ('delete', old.id, old.title, old.content);
+END;
+
+CREATE TRIGGER posts_fts_update AFTER UPDATE ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title, content)
+    VALUES ('delete', old.id, old.title, old.content);
+    INSERT INTO posts_fts (rowid, title, content)
+    VALUES (new.id, new.title, new.content);
+END;
+
+-- Statistics of the posts, kept up to date by the triggers below so that
+-- they are read without scanning the posts table
+CREATE TABLE post_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    post_count INTEGER NOT NULL,
+    content_bytes INTEGER NOT NULL,
+    newest_created TIMESTAMP
+);
+
+INSERT INTO post_stats (id, post_count, content_bytes, newest_created) VALUES (1, 0, 0, NULL);
+
+CREATE TRIGGER post_stats_insert AFTER INSERT ON posts BEGIN
+    UPDATE post_stats SET
+        post_count = post_count + 1,
+        content_bytes = content_bytes + length(CAST(new.content AS BLOB)),
+        newest_created = CASE WHEN newest_created IS NULL OR new.created > newest_created
+                              THEN new.created ELSE newest_created END
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER post_stats_delete AFTER DELETE ON posts BEGIN
+    UPDATE post_stats SET
+        post_count = post_count - 1,
+        content_bytes = content_bytes - length(CAST(old.content AS BLOB)),
+        newest_created = CASE WHEN old.created = newest_created
+                              THEN (SELECT MAX(created) FROM posts) ELSE newest_created END
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER post_stats_update AFTER UPDATE ON posts BEGIN
+    UPDATE post_stats SET
+        content_bytes = content_bytes - length(CAST(old.content AS BLOB))
+                                      + length(CAST(new.content AS BLOB)),
+        newest_created = CASE WHEN new.created > newest_created THEN new.created
+                              WHEN old.created = newest_created THEN (SELECT MAX(created) FROM posts)
+                              ELSE newest_created END
+    WHERE id = 1;
+END;
+
+-- Number of views of each post, written in batches by the application
+CREATE TABLE post_views (
+    post_id INTEGER PRIMARY KEY REFERENCES posts (id),
+    views INTEGER NOT NULL
+);
@@ -0,0 +1,57 @@
+import gc
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+from app import app, pool, warm_up
+
+
+# Production server for TechTrends.
+# The application and its templates are loaded, and warmed up, once in the
+# master process before it listens; it then forks the workers, so the loaded
+# code and the warm caches are shared copy-on-write.
+# Workers are recycled after serving `max_requests` requests (plus a random
+# jitter, so they do not all restart at once) to contain memory growth.
+class TechTrendsServer(BaseApplication):
+    def __init__(self, flask_app, options):
+        self.flask_app = flask_app
+        self.options = options
+        BaseApplication.__init__(self)
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.flask_app
+
+
+# Runs in the master process before each fork.
+# The master never serves requests, so it should hold no database connection;
+# objects allocated so far are moved out of the garbage collector's reach so
+# that collections in the workers do not touch, and copy, the shared pages.
+def pre_fork(server, worker):
+    pool.close()
+    gc.freeze()
+
+
+# Server options, read from the environment
+def get_options():
+    cpu_count = multiprocessing.cpu_count()
+    return {
+        'bind': os.environ.get('TECHTRENDS_BIND', '0.0.0.0:3111'),
+        'workers': int(os.environ.get('TECHTRENDS_WORKERS', cpu_count)),
+        'threads': int(os.environ.get('TECHTRENDS_THREADS', '1')),
+        'max_requests': int(os.environ.get('TECHTRENDS_MAX_REQUESTS', '10000')),
+        'max_requests_jitter': int(os.environ.get('TECHTRENDS_MAX_REQUESTS_JITTER', '1000')),
+        'timeout': int(os.environ.get('TECHTRENDS_WORKER_TIMEOUT', '30')),
+        'preload_app': True,
+        'pre_fork': pre_fork,
+    }
+
+
+# start the application on port 3111 with pre-forked workers
+if __name__ == "__main__":
+    warm_up()
+    TechTrendsServer(app, get_options()).run()
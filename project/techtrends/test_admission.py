@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+import app as techtrends
+from admission import AdmissionLimiter, Overloaded
+
+
+def test_admits_up_to_the_limit_and_rejects_when_the_queue_is_full():
+    limiter = AdmissionLimiter(max_limit=2, queue_size=0)
+    starts = [limiter.acquire(), limiter.acquire()]
+    with pytest.raises(Overloaded):
+        limiter.acquire()
+    limiter.release(starts.pop())
+    starts.append(limiter.acquire())
+    stats = limiter.stats()
+    assert (stats['in_flight'], stats['admitted'], stats['rejected']) == (2, 3, 1)
+
+
+def test_queued_request_is_admitted_when_a_request_ends():
+    limiter = AdmissionLimiter(max_limit=1, queue_size=1, queue_timeout=5)
+    start = limiter.acquire()
+    admitted = threading.Event()
+
+    def wait():
+        limiter.release(limiter.acquire())
+        admitted.set()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    while limiter.stats()['waiting'] < 1:
+        time.sleep(0.001)
+    with pytest.raises(Overloaded):
+        limiter.acquire()
+    limiter.release(start)
+    assert admitted.wait(5)
+    thread.join()
+
+
+def test_queued_request_is_rejected_after_the_timeout():
+    limiter = AdmissionLimiter(max_limit=1, queue_size=1, queue_timeout=0.05)
+    limiter.acquire()
+    start = time.monotonic()
+    with pytest.raises(Overloaded):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.05
+    assert limiter.stats()['waiting'] == 0
+
+
+def test_limit_backs_off_on_slow_requests_and_grows_back():
+    limiter = AdmissionLimiter(max_limit=10, queue_size=0, target_latency=0.01, backoff=0.5)
+    limiter.release(limiter.acquire() - 1)
+    assert limiter.stats()['limit'] == 5
+    for _ in range(100):
+        limiter.release(limiter.acquire())
+    assert limiter.stats()['limit'] == 10
+
+
+def test_limit_stays_above_the_minimum():
+    limiter = AdmissionLimiter(max_limit=4, queue_size=0, target_latency=0.0, min_limit=2,
+                               backoff=0.1)
+    for _ in range(3):
+        limiter.release(limiter.acquire() - 1)
+        time.sleep(0.001)
+    assert limiter.stats()['limit'] == 2
+
+
+def test_reads_are_limited_to_the_pooled_connections():
+    assert techtrends.limiters['read'].stats()['limit'] <= techtrends.app.config['DB_POOL_SIZE']
+
+
+def test_shed_requests_are_asked_to_retry_later(client, monkeypatch):
+    monkeypatch.setitem(techtrends.limiters, 'read', AdmissionLimiter(max_limit=1, queue_size=0))
+    techtrends.limiters['read'].acquire()
+    response = client.get('/about')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(techtrends.app.config['ADMISSION_RETRY_AFTER'])
+    assert response.get_json() == {'error': 'overloaded', 'budget': 'read'}
+    assert client.get('/healthz').status_code == 200
@@ -0,0 +1,300 @@
+import base64
+import gzip
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import app as techtrends
+
+
+def cursor_of(position):
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def test_keyset_pagination_lists_every_post_once_newest_first(client, create_posts):
+    ids = create_posts(7, 'Paged')
+    seen = []
+    url = '/api/posts?limit=3'
+    while url:
+        body = client.get(url).get_json()
+        assert len(body['posts']) <= 3
+        seen += body['posts']
+        url = body['next_cursor'] and '/api/posts?limit=3&cursor=' + body['next_cursor']
+    keys = [(post['created'], post['id']) for post in seen]
+    assert keys == sorted(keys, reverse=True)
+    assert len(set(keys)) == len(keys)
+    assert set(ids) <= {post['id'] for post in seen}
+
+
+def test_main_page_follows_the_cursor(client, create_posts):
+    ids = create_posts(3, 'Listed')
+    first = client.get('/?limit=2')
+    assert first.status_code == 200
+    assert b'Listed 2' in first.data
+    cursor = client.get('/api/posts?limit=2').get_json()['next_cursor']
+    second = client.get('/?limit=2&cursor=' + cursor)
+    assert second.status_code == 200
+    assert b'Listed 0' in second.data
+    assert client.get('/%d' % ids[0]).status_code == 200
+
+
+def test_bulk_api_creates_the_valid_posts(client):
+    response = client.post('/api/posts/bulk', json={'posts': [
+        {'title': 'Bulk', 'content': 'text'}, {'title': ''}, 'post', {'title': 'T', 'content': 1}]})
+    assert response.status_code == 201
+    body = response.get_json()
+    assert (body['created'], body['rejected']) == (1, 3)
+    assert [result['status'] for result in body['results']] == [
+        'created', 'rejected', 'rejected', 'rejected']
+    post_id = body['results'][0]['id']
+    posts = client.get('/api/posts?ids=%d,%d' % (post_id, post_id + 10 ** 6)).get_json()
+    assert [post['title'] for post in posts['posts']] == ['Bulk']
+    assert posts['missing'] == [post_id + 10 ** 6]
+
+
+@pytest.mark.parametrize('body', [None, {'posts': 'x'}, 'posts'])
+def test_bulk_api_rejects_a_body_without_a_list(client, body):
+    assert client.post('/api/posts/bulk', json=body).status_code == 400
+
+
+def test_bulk_api_limits_the_number_of_posts(client):
+    limit = techtrends.app.config['API_MAX_BULK_POSTS']
+    response = client.post('/api/posts/bulk', json=[{'title': 'x'}] * (limit + 1))
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('url', [
+    '/api/posts?ids=1,x',
+    '/api/posts?ids=99999999999999999999',
+    '/api/posts/views?ids=99999999999999999999',
+    '/api/posts/views?ids=-99999999999999999999',
+    '/api/posts?ids=' + ','.join(['1'] * 101),
+    '/?limit=0',
+    '/api/posts?limit=0',
+    '/api/posts?limit=x',
+    '/?cursor=' + cursor_of('2020-01-01 00:00:00|99999999999999999999'),
+    '/api/posts?cursor=' + cursor_of('2020-01-01 00:00:00|x'),
+    '/api/posts?cursor=%E2%82%AC',
+    '/api/posts?cursor=not-base64!',
+    '/search?q=cloud&page=0',
+    '/search?q=cloud&page=99999999999999999999',
+    '/api/search?q=cloud&page=99999999999999999999&limit=1',
+    '/api/search?q=cloud&limit=x',
+])
+def test_invalid_arguments_get_a_400(client, url):
+    assert client.get(url).status_code == 400
+
+
+def test_search_finds_and_highlights_the_posts(client, create_posts):
+    ids = create_posts(3, 'Searchable')
+    body = client.get('/api/search?q=searchable&limit=2').get_json()
+    assert len(body['results']) == 2
+    assert body['next_page'] == 2
+    body = client.get('/api/search?q=searchable&limit=2&page=2').get_json()
+    assert body['next_page'] is None
+    response = client.get('/search?q=native')
+    assert response.status_code == 200
+    assert b'cloud <mark>native</mark>' in response.data
+    assert ids[0] in [result['id'] for result in
+                      client.get('/api/search?q=searchable').get_json()['results']]
+
+
+@pytest.mark.parametrize('url', [
+    '/search?q=cloud%00native',
+    '/api/search?q=%00',
+    '/api/search?q=%22cloud%22%20OR%20*',
+])
+def test_unusual_searches_are_answered(client, url):
+    assert client.get(url).status_code == 200
+
+@pytest.mark.parametrize('url', ['/0', '/-1', '/99999999999999999999'])
+def test_missing_posts_get_a_404(client, url):
+    assert client.get(url).status_code == 404
+
+
+def test_batched_fetch_takes_the_largest_row_id(client):
+    body = client.get('/api/posts?ids=9223372036854775807').get_json()
+    assert body['posts'] == []
+    assert body['missing'] == [9223372036854775807]
+
+
+def test_post_views_are_counted(client, create_posts):
+    post_id = create_posts(1, 'Viewed')[0]
+    for _ in range(3):
+        assert client.get('/%d' % post_id).status_code == 200
+    views = client.get('/api/posts/views?ids=%d' % post_id).get_json()['views']
+    assert views == {str(post_id): 3}
+    techtrends.post_views.flush()
+    views = client.get('/api/posts/views?ids=%d' % post_id).get_json()['views']
+    assert views == {str(post_id): 3}
+
+
+def test_post_views_without_the_views_table(tmp_path, monkeypatch):
+    connection = sqlite3.connect(str(tmp_path / 'old.db'))
+    connection.row_factory = sqlite3.Row
+    monkeypatch.setattr(techtrends, 'get_db_connection', lambda: connection)
+    try:
+        assert techtrends.get_post_views([1]) == {1: 0}
+    finally:
+        connection.close()
+
+
+def test_post_created_by_another_process_is_found_after_the_main_page(client, monkeypatch):
+    monkeypatch.setattr(techtrends.post_ids, 'refresh_interval', 3600)
+    with techtrends.app.app_context():
+        techtrends.post_ids.refresh()
+    connection = sqlite3.connect(techtrends.app.config['DATABASE'])
+    post_id = connection.execute(
+        "INSERT INTO posts (title, content) VALUES ('Elsewhere', '')").lastrowid
+    connection.commit()
+    connection.close()
+    assert client.get('/%d' % post_id).status_code == 404
+    assert client.get('/').status_code == 200
+    assert client.get('/%d' % post_id).status_code == 200
+
+
+def test_streamed_main_page_holds_a_connection_until_it_is_sent(client, create_posts, monkeypatch):
+    create_posts(5, 'Streamed')
+    monkeypatch.setitem(techtrends.app.config, 'STREAM_INDEX', True)
+    monkeypatch.setitem(techtrends.app.config, 'STREAM_BUFFER_POSTS', 2)
+    response = client.get('/?limit=3', buffered=False)
+    assert response.status_code == 200
+    page = b''
+    in_use = []
+    for chunk in response.response:
+        page += chunk
+        in_use.append(techtrends.pool.stats()['in_use'])
+    response.close()
+    assert max(in_use) == 1
+    assert techtrends.pool.stats()['in_use'] == 0
+    assert page.count(b'Streamed') == 3
+    assert b'Older posts' in page
+
+
+def test_main_page_is_revalidated_with_its_etag(client, create_posts):
+    create_posts(1, 'Cached')
+    response = client.get('/')
+    etag = response.headers['ETag']
+    assert 'Last-Modified' not in response.headers
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    create_posts(1, 'Newer')
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_post_page_is_revalidated_with_its_etag_or_date(client, create_posts):
+    post_id = create_posts(1, 'Dated')[0]
+    response = client.get('/%d' % post_id)
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert client.get('/%d' % post_id, headers={'If-None-Match': etag}).status_code == 304
+    response = client.get('/%d' % post_id, headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+    response = client.get('/%d' % post_id, headers={'If-None-Match': '"other"',
+                                                   'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+
+
+def test_pages_are_compressed_for_the_clients_accepting_it(client, create_posts, monkeypatch):
+    create_posts(1, 'Compressed')
+    monkeypatch.setitem(techtrends.app.config, 'COMPRESS_MIN_SIZE', 1)
+    plain = client.get('/')
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == plain.data
+    assert response.headers['ETag'] == 'W/' + plain.headers['ETag']
+    response = client.get('/', headers={'Accept-Encoding': 'gzip',
+                                        'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+@pytest.fixture
+def static_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(techtrends.app, 'static_folder', str(tmp_path))
+    monkeypatch.setattr(techtrends, 'static_hashes', {})
+    (tmp_path / 'site.css').write_text('body { color: black; }\n' * 100)
+    return tmp_path
+
+
+def test_static_files_are_cached_forever_under_their_current_version(client, static_folder):
+    version = techtrends.static_file_hash('site.css')
+    response = client.get('/static/site.css?v=' + version)
+    assert response.headers['Cache-Control'] == 'public, max-age=%d, immutable' % (
+        techtrends.app.config['STATIC_MAX_AGE'])
+    response.close()
+    max_age = 'public, max-age=%d' % techtrends.app.config['STATIC_UNVERSIONED_MAX_AGE']
+    for url in ('/static/site.css?v=0123456789ab', '/static/site.css'):
+        response = client.get(url)
+        assert response.headers['Cache-Control'] == max_age
+        response.close()
+
+
+def test_fresh_pre_compressed_static_variants_are_served(client, static_folder):
+    css = (static_folder / 'site.css').read_bytes()
+    variant = static_folder / 'site.css.gz'
+    variant.write_bytes(gzip.compress(css))
+    response = client.get('/static/site.css', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert gzip.decompress(response.get_data()) == css
+    response.close()
+
+    stat = os.stat(str(static_folder / 'site.css'))
+    os.utime(str(variant), (stat.st_atime, stat.st_mtime - 10))
+    response = client.get('/static/site.css', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data() == css
+    response.close()
+
+
+def test_health_probes(client):
+    assert client.get('/healthz').status_code == 200
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert set(response.get_json()['checks']) == {'in_flight', 'lag_ms', 'db_pool_usage'}
+
+
+def readiness_reasons(client, **environ):
+    response = client.get('/readyz', environ_overrides=environ)
+    if response.status_code == 200:
+        return []
+    assert response.status_code == 503
+    return response.get_json()['reasons']
+
+
+def test_not_ready_while_warming_up(client, monkeypatch):
+    started = threading.Lock()
+    started.acquire()
+    monkeypatch.setattr(techtrends, 'warm_up_started', started)
+    monkeypatch.setattr(techtrends, 'warmed_up', threading.Event())
+    assert readiness_reasons(client) == ['warming up']
+
+
+@pytest.mark.parametrize('setting, value, reason', [
+    ('READY_MAX_IN_FLIGHT', 0, 'too many requests in flight'),
+    ('READY_MAX_LAG_MS', 0, 'workers lagging'),
+    ('READY_MAX_POOL_USAGE', 0, 'database pool saturated'),
+])
+def test_not_ready_past_a_threshold(client, monkeypatch, setting, value, reason):
+    assert readiness_reasons(client) == []
+    monkeypatch.setitem(techtrends.app.config, setting, value)
+    assert readiness_reasons(client) == [reason]
+
+
+def test_not_ready_when_the_event_loop_lags(client):
+    lag = techtrends.app.config['READY_MAX_LAG_MS'] / 1000.0
+    assert readiness_reasons(client, **{'techtrends.loop_lag': lag}) == ['workers lagging']
+
+
+def test_not_ready_without_the_database(client, monkeypatch):
+    def acquire(timeout=None):
+        raise techtrends.PoolTimeout('no database connection available after 0.5s')
+
+    monkeypatch.setattr(techtrends.pool, 'acquire', acquire)
+    assert readiness_reasons(client) == ['database unavailable']
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+
+import pytest
+
+import app as techtrends
+from asgi import AsgiAdapter, build_environ
+
+
+# Send one HTTP request to an ASGI application; returns the messages it sent
+async def request(application, path='/', method='GET', body=b'', headers=(), query_string=b''):
+    messages = []
+    requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    scope = {'type': 'http', 'method': method, 'path': path, 'root_path': '',
+             'query_string': query_string, 'headers': list(headers),
+             'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+
+    async def receive():
+        if requests:
+            return requests.pop(0)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages
+
+
+def call(application, *args, **kwargs):
+    return asyncio.run(request(application, *args, **kwargs))
+
+
+def echo(environ, start_response):
+    body = environ['wsgi.input'].read()
+    start_response('201 Created', [('Content-Type', 'text/plain'),
+                                   ('X-Query', environ['QUERY_STRING'])])
+    return [environ['PATH_INFO'].encode('latin-1'), b' ', body]
+
+
+def test_adapter_runs_the_wsgi_application():
+    messages = call(AsgiAdapter(echo, max_workers=1), '/path', 'POST', b'body',
+                    query_string=b'a=1')
+    assert messages[0]['status'] == 201
+    assert (b'x-query', b'a=1') in messages[0]['headers']
+    assert b''.join(message.get('body', b'') for message in messages[1:]) == b'/path body'
+    assert messages[-1] == {'type': 'http.response.body', 'body': b''}
+
+
+def test_adapter_sends_each_chunk_as_it_is_produced():
+    def application(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return iter([b'first', b'', b'second'])
+
+    messages = call(AsgiAdapter(application, max_workers=1))
+    assert [message.get('body') for message in messages[1:]] == [b'first', b'second', b'']
+    assert [message.get('more_body', False) for message in messages[1:]] == [True, True, False]
+
+
+def test_adapter_answers_500_when_the_application_fails_before_the_response():
+    def application(environ, start_response):
+        raise RuntimeError('broken')
+
+    messages = call(AsgiAdapter(application, max_workers=1))
+    assert messages[0]['status'] == 500
+    assert messages[-1]['body'] == b''
+
+
+def test_adapter_aborts_a_response_failing_midway():
+    def application(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        yield b'start'
+        raise RuntimeError('broken')
+
+    with pytest.raises(RuntimeError):
+        call(AsgiAdapter(application, max_workers=1))
+
+
+def test_build_environ_follows_pep_3333():
+    environ = build_environ({
+        'type': 'http', 'method': 'GET', 'path': '/app/café', 'root_path': '/app',
+        'query_string': b'q=1', 'headers': [(b'content-type', b'text/html'),
+                                            (b'accept', b'a'), (b'accept', b'b')],
+    }, b'')
+    assert environ['SCRIPT_NAME'] == '/app'
+    assert environ['PATH_INFO'] == '/café'.encode('utf-8').decode('latin-1')
+    assert environ['CONTENT_TYPE'] == 'text/html'
+    assert environ['HTTP_ACCEPT'] == 'a,b'
+    assert environ['CONTENT_LENGTH'] == '0'
+
+
+def test_adapter_serves_the_application(create_posts):
+    post_id = create_posts(1, 'Served')[0]
+    messages = call(AsgiAdapter(techtrends.app, max_workers=2), '/%d' % post_id)
+    assert messages[0]['status'] == 200
+    assert b'Served 0' in b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def test_probes_answer_while_every_worker_is_busy():
+    release = threading.Event()
+
+    def application(environ, start_response):
+        if environ['PATH_INFO'] == '/slow':
+            release.wait(5)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [environ['PATH_INFO'].encode('latin-1')]
+
+    adapter = AsgiAdapter(application, max_workers=1, max_queue=0, live_path='/healthz',
+                          priority_paths=('/readyz',))
+
+    async def probes():
+        slow = asyncio.ensure_future(request(adapter, '/slow'))
+        while adapter._pending < 1:
+            await asyncio.sleep(0.001)
+        try:
+            return {path: await request(adapter, path)
+                    for path in ('/healthz', '/readyz', '/other')}
+        finally:
+            release.set()
+            await slow
+
+    responses = asyncio.run(probes())
+    assert responses['/healthz'][0]['status'] == 200
+    assert responses['/healthz'][1]['body'] == b'{"result": "OK - healthy"}'
+    assert responses['/readyz'][0]['status'] == 200
+    assert responses['/readyz'][1]['body'] == b'/readyz'
+    assert responses['/other'][0]['status'] == 503
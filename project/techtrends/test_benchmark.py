@@ -0,0 +1,32 @@
+import pytest
+
+from benchmark import find_regressions, percentile
+
+
+def results(p95=10.0, throughput=100.0, **settings):
+    route = {'requests': 100, 'errors': 0, 'p50': 5.0, 'p95': p95, 'p99': 20.0,
+             'throughput': throughput}
+    values = {'target': 'client', 'posts': 1000, 'concurrency': 8, 'routes': {'index': route}}
+    values.update(settings)
+    return values
+
+
+def test_percentile_uses_the_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.5) == 0.0
+
+
+def test_find_regressions_applies_the_tolerance():
+    baseline = results()
+    assert find_regressions(results(p95=10.5, throughput=95.0), baseline, 0.1) == []
+    assert find_regressions(results(p95=12.0, throughput=80.0), baseline, 0.1) == [
+        'index p95: 10.00 -> 12.00', 'index throughput: 100.00 -> 80.00']
+
+
+@pytest.mark.parametrize('settings', [
+    {'target': 'server'}, {'posts': 10}, {'concurrency': 1}])
+def test_find_regressions_refuses_a_baseline_with_other_settings(settings):
+    with pytest.raises(ValueError):
+        find_regressions(results(**settings), results(), 0.1)
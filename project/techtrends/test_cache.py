@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+from cache import IdUpperBound, LRUCache, MISSING, SingleFlight
+
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is MISSING
+    assert len(cache) == 0
+    assert cache.stats()['expirations'] == 1
+
+
+def test_lru_cache_counts_hits_and_misses():
+    cache = LRUCache()
+    cache.set('a', None)
+    assert cache.get('a') is None
+    assert cache.get('b') is MISSING
+    cache.delete('a')
+    assert cache.get('a') is MISSING
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 2)
+
+
+def test_id_upper_bound_answers_without_loading_below_the_bound():
+    loads = []
+    bound = IdUpperBound(lambda: loads.append(1) or 10, refresh_interval=60)
+    assert bound.may_exist(5)
+    assert bound.may_exist(10)
+    assert not bound.may_exist(11)
+    assert not bound.may_exist(0)
+    assert len(loads) == 1
+
+
+def test_id_upper_bound_refreshes_after_the_interval():
+    max_ids = [10]
+    bound = IdUpperBound(lambda: max_ids[0], refresh_interval=0.01)
+    assert not bound.may_exist(12)
+    max_ids[0] = 12
+    assert not bound.may_exist(12)
+    time.sleep(0.02)
+    assert bound.may_exist(12)
+
+
+def test_id_upper_bound_observes_inserted_ids():
+    bound = IdUpperBound(lambda: 10, refresh_interval=60)
+    bound.refresh()
+    bound.observe(15)
+    assert bound.may_exist(15)
+    bound.observe(3)
+    assert bound.may_exist(15)
+
+
+# Start `count` threads calling `flights.do(key, function)`; returns the
+# threads and the list their results are appended to
+def start_calls(flights, key, function, count):
+    results = []
+
+    def call():
+        try:
+            results.append(flights.do(key, function))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def function():
+        calls.append(1)
+        release.wait(5)
+        return 'page'
+
+    threads, results = start_calls(flights, 1, function, 5)
+    while flights.stats()['followers'] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ['page'] * 5
+    assert len(calls) == 1
+    assert flights.stats() == {'in_flight': 0, 'leaders': 1, 'followers': 4, 'timeouts': 0}
+
+
+def test_single_flight_shares_the_error_of_the_leader():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def function():
+        release.wait(5)
+        raise KeyError('post')
+
+    threads, results = start_calls(flights, 1, function, 3)
+    while flights.stats()['followers'] < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(result, KeyError) for result in results)
+    assert flights.do(1, lambda: 'retried') == 'retried'
+
+
+def test_single_flight_abandons_a_stuck_leader():
+    flights = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    threads, results = start_calls(flights, 1, lambda: release.wait(5) and 'stuck', 1)
+    while flights.stats()['leaders'] < 1:
+        time.sleep(0.001)
+    assert flights.do(1, lambda: 'fresh') == 'fresh'
+    assert flights.stats()['timeouts'] == 1
+    release.set()
+    threads[0].join()
+    assert results == ['stuck']
+
+
+def test_single_flight_keeps_keys_apart():
+    flights = SingleFlight()
+    assert flights.do(1, lambda: 'a') == 'a'
+    assert flights.do(2, lambda: 'b') == 'b'
+    assert flights.stats()['leaders'] == 2
+    with pytest.raises(ValueError):
+        flights.do(3, lambda: int('x'))
+    assert flights.stats()['in_flight'] == 0
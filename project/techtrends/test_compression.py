@@ -0,0 +1,33 @@
+import gzip
+import mimetypes
+
+from werkzeug.datastructures import Accept
+
+from compression import choose_encoding, compress, is_compressible, precompress_folder
+
+
+def test_choose_encoding_prefers_the_first_accepted_encoding():
+    accept = Accept([('gzip', 1), ('br', 0.5)])
+    assert choose_encoding(accept, ('br', 'gzip')) == 'br'
+    assert choose_encoding(Accept([('br', 0), ('gzip', 1)]), ('br', 'gzip')) == 'gzip'
+    assert choose_encoding(Accept([('identity', 1)]), ('br', 'gzip')) is None
+
+
+def test_only_text_like_types_are_compressed():
+    assert is_compressible('text/css')
+    assert is_compressible('application/json')
+    assert not is_compressible('image/png')
+    assert not is_compressible(None)
+
+
+def test_precompress_folder_writes_the_smaller_variants(tmp_path):
+    (tmp_path / 'main.css').write_text('body { color: black; }\n' * 100)
+    (tmp_path / 'tiny.css').write_text('a{}')
+    (tmp_path / 'logo.png').write_bytes(b'\x89PNG' * 100)
+    written = precompress_folder(str(tmp_path), mimetypes)
+    assert str(tmp_path / 'main.css.gz') in written
+    assert gzip.decompress((tmp_path / 'main.css.gz').read_bytes()) == (
+        tmp_path / 'main.css').read_bytes()
+    assert not (tmp_path / 'tiny.css.gz').exists()
+    assert not (tmp_path / 'logo.png.gz').exists()
+    assert gzip.decompress(compress(b'data', 'gzip')) == b'data'
@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+
+from flask import Flask
+
+from conditional import is_not_modified, make_etag, parse_timestamp
+
+app = Flask(__name__)
+
+
+def test_make_etag_depends_on_every_part():
+    assert make_etag('index', 1, None) == make_etag('index', 1, None)
+    assert make_etag('index', 1, None) != make_etag('index', 2, None)
+
+
+def test_parse_timestamp_reads_sqlite_dates_as_utc():
+    assert parse_timestamp('2021-03-04 05:06:07') == datetime(
+        2021, 3, 4, 5, 6, 7, tzinfo=timezone.utc)
+    assert parse_timestamp(None) is None
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    created = parse_timestamp('2021-03-04 05:06:07')
+    headers = {'If-None-Match': '"other"', 'If-Modified-Since': 'Thu, 04 Mar 2021 05:06:07 GMT'}
+    with app.test_request_context('/', headers=headers) as context:
+        assert not is_not_modified(context.request, 'etag', created)
+    with app.test_request_context('/', headers={'If-None-Match': 'W/"etag"'}) as context:
+        assert is_not_modified(context.request, 'etag', created)
+
+
+def test_if_modified_since_compares_whole_seconds():
+    headers = {'If-Modified-Since': 'Thu, 04 Mar 2021 05:06:07 GMT'}
+    with app.test_request_context('/', headers=headers) as context:
+        assert is_not_modified(context.request, 'etag', datetime(
+            2021, 3, 4, 5, 6, 7, 500000, tzinfo=timezone.utc))
+        assert not is_not_modified(context.request, 'etag', datetime(
+            2021, 3, 4, 5, 6, 8, tzinfo=timezone.utc))
+    with app.test_request_context('/', method='POST', headers=headers) as context:
+        assert not is_not_modified(context.request, 'etag', parse_timestamp('2020-01-01 00:00:00'))
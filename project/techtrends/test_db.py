@@ -0,0 +1,315 @@
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import TimeoutError as WriteTimeout
+
+import pytest
+
+import app as techtrends
+from db import (ConnectionPool, GroupCommitWriter, PoolTimeout, QueryStats, WriteBehindCounter,
+                normalize_sql)
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'test.db')
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER UNIQUE)')
+    connection.execute('CREATE TABLE counts (key INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+    connection.commit()
+    connection.close()
+    return path
+
+
+# Hold a connection of `pool` on another thread until `release` is set
+def hold(pool, release):
+    acquired = threading.Event()
+
+    def run():
+        connection = pool.acquire()
+        acquired.set()
+        release.wait()
+        pool.release(connection)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert acquired.wait(5)
+    return thread
+
+
+def test_pool_reuses_the_connection_held_by_the_thread(database):
+    pool = ConnectionPool(database, max_size=2)
+    connection = pool.acquire()
+    assert pool.acquire() is connection
+    pool.release(connection)
+    assert pool.stats()['in_use'] == 1
+    pool.release(connection)
+    assert pool.stats() == {'max_size': 2, 'open': 1, 'in_use': 0, 'idle': 1}
+    assert pool.acquire() is connection
+
+
+def test_pool_rejects_the_release_of_a_connection_not_held(database):
+    pool = ConnectionPool(database)
+    connection = pool.connect()
+    with pytest.raises(ValueError):
+        pool.release(connection)
+
+
+def test_pool_rolls_back_on_release(database):
+    pool = ConnectionPool(database, max_size=1)
+    connection = pool.acquire()
+    connection.execute('INSERT INTO items (value) VALUES (1)')
+    assert connection.in_transaction
+    pool.release(connection)
+    connection = pool.acquire()
+    assert connection.execute('SELECT COUNT(*) FROM items').fetchone()[0] == 0
+
+
+def test_pool_times_out_when_every_connection_is_in_use(database):
+    pool = ConnectionPool(database, max_size=2, timeout=0.1)
+    release = threading.Event()
+    threads = [hold(pool, release), hold(pool, release)]
+    assert pool.stats()['open'] == 2
+    start = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert time.monotonic() - start >= 0.1
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert pool.stats() == {'max_size': 2, 'open': 2, 'in_use': 0, 'idle': 2}
+
+
+def test_pool_hands_a_released_connection_to_a_waiting_thread(database):
+    pool = ConnectionPool(database, max_size=1)
+    release = threading.Event()
+    thread = hold(pool, release)
+    threading.Timer(0.05, release.set).start()
+    connection = pool.acquire(timeout=5)
+    thread.join()
+    assert pool.stats()['open'] == 1
+    pool.release(connection)
+
+
+
+def test_group_commit_returns_the_row_ids(database):
+    pool = ConnectionPool(database)
+    writer = GroupCommitWriter(pool.connect)
+    futures = [writer.submit('INSERT INTO items (value) VALUES (?)', (value,))
+               for value in range(10)]
+    ids = [future.result(5) for future in futures]
+    assert sorted(ids) == list(range(1, 11))
+
+
+def test_group_commit_fails_only_the_failing_statement(database):
+    pool = ConnectionPool(database)
+    writer = GroupCommitWriter(pool.connect, max_delay=0.05)
+    good = writer.submit('INSERT INTO items (value) VALUES (1)')
+    duplicate = writer.submit('INSERT INTO items (value) VALUES (1)')
+    overflow = writer.submit('INSERT INTO items (value) VALUES (?)', (2 ** 64,))
+    assert good.result(5) == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        duplicate.result(5)
+    with pytest.raises(OverflowError):
+        overflow.result(5)
+    assert writer.execute('INSERT INTO items (value) VALUES (2)', timeout=5) == 2
+
+
+def test_group_commit_survives_a_connection_failure(database):
+    pool = ConnectionPool(database)
+    failures = [sqlite3.OperationalError('unable to open database file')]
+
+    def connect():
+        if failures:
+            raise failures.pop()
+        return pool.connect()
+
+    writer = GroupCommitWriter(connect)
+    with pytest.raises(sqlite3.OperationalError):
+        writer.execute('INSERT INTO items (value) VALUES (1)', timeout=5)
+    assert writer.execute('INSERT INTO items (value) VALUES (1)', timeout=5) == 1
+
+
+def test_normalize_sql_groups_the_statements_by_their_shape():
+    assert normalize_sql("SELECT * FROM posts WHERE id IN (1, 2,3) AND title = 'it''s'") == (
+        'SELECT * FROM posts WHERE id IN (?, ...) AND title = ?')
+    assert normalize_sql('SELECT *\n  FROM posts WHERE id = ?') == 'SELECT * FROM posts WHERE id = ?'
+
+
+def test_query_stats_aggregate_the_durations(database):
+    stats = QueryStats(slow_threshold=1)
+    pool = ConnectionPool(database, observer=stats.observe)
+    connection = pool.acquire()
+    for value in range(3):
+        connection.execute('SELECT * FROM items WHERE value = %d' % value).fetchall()
+    connection.execute('SELECT COUNT(*) FROM counts').fetchall()
+    pool.release(connection)
+    queries = {query['sql']: query for query in stats.snapshot()}
+    query = queries['SELECT * FROM items WHERE value = ?']
+    assert query['count'] == 3
+    assert sum(query['histogram'].values()) == 3
+    assert query['max_ms'] <= query['total_ms']
+    assert queries['SELECT COUNT(*) FROM counts']['count'] == 1
+    assert not stats.slow_queries
+    stats.reset()
+    assert stats.snapshot() == []
+
+
+def test_slow_queries_are_logged_with_their_plan(database, caplog):
+    stats = QueryStats(slow_threshold=0)
+    connection = sqlite3.connect(database)
+    sql = 'SELECT * FROM items WHERE value = ?'
+    with caplog.at_level(logging.WARNING):
+        stats.observe(connection, sql, (1,), 0.2)
+        stats.observe(connection, sql, (2,), 0.3)
+    connection.close()
+    first, second = stats.slow_queries
+    assert first['duration_ms'] == 200
+    assert any('value' in step for step in first['plan'])
+    assert second['plan'] is first['plan']
+    assert 'slow query (200.0 ms): ' + sql in caplog.text
+    assert stats.explain(None, 'PRAGMA user_version', ()) == []
+
+# A request finding every pooled connection busy is asked to retry later
+def test_pool_timeout_gets_a_503(client, monkeypatch):
+    def acquire(timeout=None):
+        raise PoolTimeout('no database connection available after 5.0s')
+
+    monkeypatch.setattr(techtrends.pool, 'acquire', acquire)
+    response = client.get('/api/posts')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(techtrends.app.config['ADMISSION_RETRY_AFTER'])
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert response.get_json() == {'error': 'database busy'}
+
+
+# A post the writer did not commit in time is answered 503, as is a busy pool
+def test_write_timeout_gets_a_503(client, monkeypatch):
+    class StuckWriter:
+        def execute(self, sql, parameters=(), timeout=None):
+            raise WriteTimeout()
+
+    monkeypatch.setattr(techtrends, 'writer', StuckWriter())
+    response = client.post('/create', data={'title': 'Stuck', 'content': ''})
+    assert response.status_code == 503
+    assert response.get_json() == {'error': 'database busy'}
+
+
+def test_write_timeout_outlasts_the_busy_timeout():
+    busy_timeout = int(dict(techtrends.app.config['DB_PRAGMAS'])['busy_timeout']) / 1000.0
+    assert techtrends.app.config['DB_WRITE_TIMEOUT'] > (
+        busy_timeout + techtrends.app.config['DB_GROUP_COMMIT_DELAY'])
+
+
+def test_query_statistics_are_listed_to_the_admins(client):
+    headers = {'Authorization': 'Bearer secret'}
+    client.get('/')
+    assert client.get('/admin/queries').status_code == 401
+    body = client.get('/admin/queries', headers=headers).get_json()
+    assert any(query['sql'].startswith('SELECT') for query in body['queries'])
+    assert client.delete('/admin/queries', headers=headers).get_json()['queries'] == []
+
+
+COUNT_SQL = ('INSERT INTO counts (key, value) VALUES (?, ?) '
+             'ON CONFLICT (key) DO UPDATE SET value = value + excluded.value')
+
+
+def read_counts(database):
+    connection = sqlite3.connect(database)
+    try:
+        return dict(connection.execute('SELECT key, value FROM counts'))
+    finally:
+        connection.close()
+
+
+def test_write_behind_counter_adds_up_and_flushes(database):
+    pool = ConnectionPool(database)
+    counter = WriteBehindCounter(pool.connect, COUNT_SQL, interval=60)
+    for key in (1, 1, 2, 1):
+        counter.inc(key)
+    assert counter.pending(1) == 3
+    assert counter.stats()['pending_keys'] == 2
+    assert counter.flush() == 2
+    assert read_counts(database) == {1: 3, 2: 1}
+    assert counter.pending(1) == 0
+    counter.inc(1, 5)
+    counter.flush()
+    assert read_counts(database) == {1: 8, 2: 1}
+
+
+def test_write_behind_counter_keeps_the_counts_of_a_failed_flush(database):
+    pool = ConnectionPool(database)
+    counter = WriteBehindCounter(pool.connect, COUNT_SQL.replace('counts', 'later'),
+                                 interval=60)
+    counter.inc(1, 2)
+    assert counter.flush() == 0
+    assert counter.failures == 1
+    assert counter.pending(1) == 2
+    connection = sqlite3.connect(database)
+    connection.execute('CREATE TABLE later (key INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+    connection.commit()
+    connection.close()
+    counter.inc(1)
+    assert counter.flush() == 1
+    assert counter.pending(1) == 0
+
+
+def test_write_behind_counter_folds_the_counts_of_finished_threads(database):
+    pool = ConnectionPool(database)
+    counter = WriteBehindCounter(pool.connect, COUNT_SQL, interval=60)
+    for _ in range(200):
+        thread = threading.Thread(target=counter.inc, args=(7,))
+        thread.start()
+        thread.join()
+    assert len(counter._shards) == 0
+    assert counter.pending(7) == 200
+    counter.flush()
+    assert read_counts(database) == {7: 200}
+
+
+def test_write_behind_counter_totals_count_each_view_once(database):
+    pool = ConnectionPool(database)
+    counter = WriteBehindCounter(pool.connect, COUNT_SQL, interval=60)
+    counter.inc(1, 3)
+    flushing = threading.Event()
+    commit = threading.Event()
+    totals = {}
+
+    # A flush between the collection of the counts and their commit
+    def execute(*args):
+        flushing.set()
+        commit.wait(5)
+        return execute_many(*args)
+
+    connection = pool.connect()
+    execute_many = connection.executemany
+    counter.connect = lambda: FlushConnection(connection, execute)
+    flusher = threading.Thread(target=counter.flush)
+    flusher.start()
+    assert flushing.wait(5)
+    assert counter.totals([1], lambda keys: {1: read_counts(database).get(1, 0)}) == {1: 3}
+
+    # A read of the written counts racing the commit of the flush
+    def read_written(keys):
+        commit.set()
+        time.sleep(0.05)
+        return {1: read_counts(database).get(1, 0)}
+
+    reader = threading.Thread(target=lambda: totals.update(counter.totals([1], read_written)))
+    reader.start()
+    reader.join()
+    flusher.join()
+    assert totals == {1: 3}
+    assert read_counts(database) == {1: 3}
+    assert counter.totals([1], lambda keys: {1: read_counts(database)[1]}) == {1: 3}
+
+
+# Connection whose `executemany` is replaced, e.g. to pause a flush
+class FlushConnection:
+    def __init__(self, connection, executemany):
+        self.connection = connection
+        self.executemany = executemany
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
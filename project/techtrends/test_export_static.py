@@ -0,0 +1,67 @@
+import filecmp
+import os
+import re
+import sqlite3
+
+import pytest
+
+from app import app, template_version
+from export_static import export_site
+from load_posts import connect, generate_posts, load_posts
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def connection(tmp_path):
+    path = str(tmp_path / 'export.db')
+    loader = connect(path)
+    with open(os.path.join(HERE, 'schema.sql')) as f:
+        loader.executescript(f.read())
+    loader.close()
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    yield connection
+    connection.close()
+
+
+def add_posts(connection, count):
+    load_posts(connection, generate_posts(count, seed=count), defer_indexes=False)
+
+
+def titles(folder, name):
+    with open(os.path.join(folder, name)) as f:
+        return re.findall(r'<h2>([^<]+)', f.read())
+
+
+def links(folder, name):
+    with open(os.path.join(folder, name)) as f:
+        return [link for link in re.findall(r'href="([^"]+)"', f.read()) if 'page-' in link]
+
+
+def test_main_page_lists_the_newest_posts(connection, tmp_path):
+    add_posts(connection, 33)
+    folder = str(tmp_path / 'site')
+    export_site(app, connection, template_version, folder, per_page=4)
+    assert titles(folder, 'index.html') == titles(folder, 'page-9.html') + titles(
+        folder, 'page-8.html')[:3]
+    assert links(folder, 'index.html') == ['/page-8']
+    assert links(folder, 'page-9.html') == ['/page-8']
+    assert links(folder, 'page-1.html') == ['/page-2']
+    assert not os.path.exists(os.path.join(folder, 'page-10.html'))
+
+
+def test_incremental_export_matches_a_full_export(connection, tmp_path):
+    add_posts(connection, 33)
+    folder = str(tmp_path / 'site')
+    export_site(app, connection, template_version, folder, per_page=4)
+    for count in (3, 1, 8):
+        add_posts(connection, count)
+        summary = export_site(app, connection, template_version, folder, per_page=4)
+        assert summary['incremental']
+        assert summary['posts'] == count
+        full = str(tmp_path / ('full-%d' % count))
+        export_site(app, connection, template_version, full, per_page=4, full=True)
+        comparison = filecmp.dircmp(folder, full)
+        assert [name for name in comparison.diff_files if name != '.export.json'] == []
+        assert comparison.left_only == comparison.right_only == []
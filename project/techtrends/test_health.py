@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+from health import LagMonitor
+
+
+def test_lag_monitor_reports_the_largest_recent_lag():
+    monitor = LagMonitor(window=2)
+    assert monitor.lag() == 0.0
+    monitor.record(0.3)
+    monitor.record(-0.1)
+    assert monitor.lag() == 0.3
+    monitor.record(0.1)
+    assert monitor.lag() == 0.1
+
+
+def test_lag_monitor_measures_a_blocked_event_loop():
+    monitor = LagMonitor(interval=0.01)
+
+    async def block():
+        watch = asyncio.ensure_future(monitor.watch())
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)
+        await asyncio.sleep(0.02)
+        watch.cancel()
+
+    asyncio.run(block())
+    assert monitor.lag() >= 0.05
@@ -0,0 +1,64 @@
+import io
+import os
+
+import pytest
+
+from load_posts import connect, generate_posts, load_posts, parse_created, read_csv, read_jsonl
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def connection(tmp_path):
+    connection = connect(str(tmp_path / 'database.db'))
+    with open(os.path.join(HERE, 'schema.sql')) as f:
+        connection.executescript(f.read())
+    yield connection
+    connection.close()
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2030-01-01T10:00:00Z', '2030-01-01 10:00:00'),
+    ('2030-01-01 10:00:00', '2030-01-01 10:00:00'),
+    ('2030-01-01T12:30:00+02:00', '2030-01-01 10:30:00'),
+    ('2030-01-01T10:00:00.250', '2030-01-01 10:00:00'),
+    ('2030-01-01', '2030-01-01 00:00:00'),
+])
+def test_creation_times_are_stored_in_utc(value, expected):
+    assert parse_created(value) == expected
+
+
+@pytest.mark.parametrize('value', ['yesterday', '2030-13-01', '2030-01-01T25:00:00', 12])
+def test_invalid_creation_times_are_rejected(value):
+    with pytest.raises(ValueError):
+        parse_created(value)
+
+
+def test_jsonl_and_csv_rows(connection):
+    rows = list(read_jsonl(io.StringIO(
+        '{"title": "A", "content": "x", "created": "2030-01-01T10:00:00Z"}\n\n{"title": "B"}\n')))
+    assert rows == [('2030-01-01 10:00:00', 'A', 'x'), (None, 'B', '')]
+    rows += read_csv(io.StringIO('title,content,created\nC,y,\n'))
+    assert load_posts(connection, rows) == 3
+    created = [row[0] for row in connection.execute('SELECT created FROM posts ORDER BY id')]
+    assert created[0] == '2030-01-01 10:00:00'
+    assert all(len(value) == 19 for value in created)
+
+
+def test_a_row_without_a_title_fails_the_load(connection):
+    with pytest.raises(ValueError):
+        load_posts(connection, read_jsonl(io.StringIO('{"title": "A"}\n{"content": "x"}\n')))
+    assert connection.execute('SELECT COUNT(*) FROM posts').fetchone()[0] == 0
+
+
+@pytest.mark.parametrize('defer_indexes', [True, False])
+def test_loaded_posts_are_searchable_and_counted(connection, defer_indexes):
+    assert load_posts(connection, generate_posts(50), batch_size=20,
+                      defer_indexes=defer_indexes) == 50
+    matches = connection.execute(
+        "SELECT COUNT(*) FROM posts_fts WHERE posts_fts MATCH 'cloud'").fetchone()[0]
+    expected = connection.execute(
+        "SELECT COUNT(*) FROM posts WHERE title LIKE '%cloud%' OR content LIKE '%cloud%'"
+    ).fetchone()[0]
+    assert matches == expected
+    assert connection.execute('SELECT post_count FROM post_stats').fetchone()[0] == 50
@@ -0,0 +1,75 @@
+import io
+import json
+import logging
+import sys
+import threading
+
+from logs import BackgroundHandler, JsonFormatter, SamplingFilter, parse_rates
+
+
+def make_record(message, level=logging.INFO, **fields):
+    record = logging.makeLogRecord({'name': 'test', 'levelno': level,
+                                    'levelname': logging.getLevelName(level), 'msg': message})
+    record.__dict__.update(fields)
+    return record
+
+
+# A stream whose writes wait until `release` is set
+class BlockingStream(io.StringIO):
+    def __init__(self):
+        io.StringIO.__init__(self)
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.writing.set()
+        self.release.wait(5)
+        return io.StringIO.write(self, text)
+
+
+def test_json_formatter_writes_the_extra_fields():
+    try:
+        raise ValueError('broken')
+    except ValueError:
+        record = logging.makeLogRecord({'msg': 'failed %s', 'args': ('job',),
+                                        'exc_info': sys.exc_info()})
+    record.route = '/'
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['message'] == 'failed job'
+    assert entry['route'] == '/'
+    assert 'ValueError: broken' in entry['exception']
+
+
+def test_sampling_filter_keeps_a_fraction_of_the_frequent_routes(monkeypatch):
+    sampling = SamplingFilter(parse_rates('/healthz=0.01, /metrics=0.5'))
+    monkeypatch.setattr('random.random', lambda: 0.1)
+    assert not sampling.filter(make_record('probe', route='/healthz'))
+    assert sampling.filter(make_record('scrape', route='/metrics'))
+    assert sampling.filter(make_record('failed probe', logging.WARNING, route='/healthz'))
+    assert sampling.filter(make_record('page', route='/'))
+    assert sampling.filter(make_record('startup'))
+
+
+def test_background_handler_writes_the_queued_records_on_close():
+    stream = io.StringIO()
+    handler = BackgroundHandler(stream, flush_interval=0.01)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    for number in range(5):
+        handler.handle(make_record('record %d' % number))
+    handler.close()
+    assert stream.getvalue().splitlines() == ['record %d' % number for number in range(5)]
+
+
+def test_background_handler_drops_records_when_the_queue_is_full():
+    stream = BlockingStream()
+    handler = BackgroundHandler(stream, max_queue=2, flush_interval=0.01)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    handler.handle(make_record('written'))
+    assert stream.writing.wait(5)
+    for number in range(5):
+        handler.handle(make_record('queued %d' % number))
+    assert handler.dropped == 3
+    stream.release.set()
+    handler.close()
+    assert stream.getvalue().splitlines() == [
+        'written', 'dropped 3 log records', 'queued 0', 'queued 1']
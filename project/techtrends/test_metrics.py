@@ -0,0 +1,58 @@
+import threading
+
+from metrics import Registry
+
+
+def run_threads(function, count):
+    for _ in range(count):
+        thread = threading.Thread(target=function)
+        thread.start()
+        thread.join()
+
+
+def test_counter_and_gauge_add_up_the_threads():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests.', ('route',))
+    in_flight = registry.gauge('in_flight', 'In flight.')
+    requests.inc(('/',))
+    in_flight.inc()
+    run_threads(lambda: requests.inc(('/',), 2), 3)
+    assert 'requests_total{route="/"} 7' in registry.render()
+    assert in_flight.value() == 1
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'latency_seconds_count 3' in lines
+
+
+def test_shards_of_finished_threads_are_folded():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests.')
+    latency = registry.histogram('latency_seconds', 'Latency.', buckets=(1.0,))
+
+    def handle():
+        requests.inc()
+        latency.observe(0.5)
+
+    run_threads(handle, 500)
+    assert len(requests._shards) == 0
+    assert len(latency._shards) == 0
+    lines = registry.render().splitlines()
+    assert 'requests_total 500' in lines
+    assert 'latency_seconds_bucket{le="1"} 500' in lines
+    assert 'latency_seconds_sum 250' in lines
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    errors = registry.counter('errors_total', 'Errors.', ('message',))
+    errors.inc(('say "hi"\n',))
+    assert 'errors_total{message="say \\"hi\\"\\n"} 1' in registry.render()
@@ -0,0 +1,75 @@
+import json
+import os
+import stat
+import sys
+import time
+
+from profiling import Profiler, fold_stack
+
+
+def profile_request(profiler, path='/'):
+    profile = profiler.start()
+    sum(range(1000))
+    return profiler.stop(profile, 'GET', path, 200)
+
+
+def test_fold_stack_lists_the_calls_outermost_first():
+    stack = fold_stack(sys._getframe())
+    assert stack.endswith(';test_profiling.py:test_fold_stack_lists_the_calls_outermost_first')
+
+
+def test_profiler_writes_a_private_folder_of_profiles(monkeypatch, tmp_path):
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    profiler = Profiler()
+    summary = profile_request(profiler)
+    assert os.path.dirname(profiler.output_dir) == str(tmp_path)
+    assert stat.S_IMODE(os.stat(profiler.output_dir).st_mode) == 0o700
+    assert os.path.isfile(os.path.join(profiler.output_dir, summary['profile']))
+    with open(os.path.join(profiler.output_dir, 'profiles.jsonl')) as f:
+        assert json.loads(f.read()) == summary
+    assert profiler.state()['recent'] == [summary]
+
+
+def test_profiler_keeps_the_latest_profiles(tmp_path):
+    folder = tmp_path / 'profiles'
+    profiler = Profiler(str(folder), keep=2)
+    summaries = []
+    for number in range(4):
+        summaries.append(profile_request(profiler, '/%d' % number))
+        time.sleep(0.01)
+    assert stat.S_IMODE(os.stat(str(folder)).st_mode) == 0o700
+    assert sorted(name for name in os.listdir(str(folder)) if name.endswith('.prof')) == sorted(
+        summary['profile'] for summary in summaries[-2:])
+    with open(str(folder / 'profiles.jsonl')) as f:
+        assert [json.loads(line)['path'] for line in f] == ['/2', '/3']
+    assert [summary['path'] for summary in profiler.state()['recent']] == ['/2', '/3']
+
+
+def test_stack_sampler_stops_when_no_request_is_profiled(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profile_request(profiler)
+    deadline = time.monotonic() + 5
+    while profiler.sampler._thread is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert profiler.sampler._thread is None
+
+
+def test_requests_are_profiled_on_demand(client):
+    response = client.get('/about', headers={'X-Profile': 'secret'})
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert 'Server-Timing' not in client.get('/about').headers
+    recent = client.get('/admin/profiling', headers={
+        'Authorization': 'Bearer secret'}).get_json()['recent']
+    name = recent[-1]['profile']
+    response = client.get('/admin/profiling/' + name, headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    response.close()
+    assert client.get('/admin/profiling/' + name).status_code == 401
+
+
+def test_non_ascii_tokens_are_rejected(client):
+    assert client.get('/', headers={'X-Profile': 'é'}).status_code == 200
+    response = client.get('/admin/profiling', headers={'Authorization': 'Bearer é'})
+    assert response.status_code == 401
+    response = client.get('/admin/profiling', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
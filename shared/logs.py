@@ -0,0 +1,198 @@
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+
+
+# Attributes every log record has; the others were passed as `extra`
+# or added by a filter and are written as fields of their own
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime'}
+
+
+# Format records as JSON objects, one per line
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+# Add the fields returned by `function`, e.g. the route of the current
+# request, to every record. Runs on the thread that logs the record.
+class ContextFilter(logging.Filter):
+    def __init__(self, function):
+        logging.Filter.__init__(self)
+        self.function = function
+
+    def filter(self, record):
+        for name, value in (self.function() or {}).items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+# Keep only a `rates[route]` fraction of the records below WARNING of the
+# frequent routes, e.g. the health probes. Records of other routes, and
+# records without a `route` field, are all kept.
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        logging.Filter.__init__(self)
+        self.rates = dict(rates)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, 'route', None))
+        return rate is None or random.random() < rate
+
+
+# Parse sampling rates written as `route=rate,route=rate`
+def parse_rates(spec):
+    rates = {}
+    for item in spec.split(','):
+        if item.strip():
+            route, rate = item.rsplit('=', 1)
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+# Write records from a background thread.
+# Logging a record only puts it in a queue of at most `max_queue` records;
+# when the queue is full the record is dropped and counted instead of
+# blocking the caller. The writer thread formats the queued records and
+# writes them in batches of up to `batch_size`, flushing after every batch,
+# or at least every `flush_interval` seconds.
+class BackgroundHandler(logging.Handler):
+    def __init__(self, stream, max_queue=10000, batch_size=512, flush_interval=1.0):
+        logging.Handler.__init__(self)
+        self.stream = stream
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._reported = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # The queue lock may be held by the writer thread of the parent
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._queue = queue.Queue(self.max_queue)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    # Start the writer thread, again in a forked process
+    def _start(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self._thread.start()
+
+    def emit(self, record):
+        # The message and the exception are rendered now, as the arguments
+        # and the traceback may change before the writer gets to them
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = (self.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        if self._thread is None or not self._thread.is_alive():
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if record is None:
+                return
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._write(batch)
+                    return
+                batch.append(record)
+            self._write(batch)
+
+    def _write(self, batch):
+        lines = []
+        dropped = self.dropped
+        if dropped > self._reported:
+            lines.append(self.format(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': 'dropped %d log records' % (dropped - self._reported)})))
+            self._reported = dropped
+        for record in batch:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        try:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+        except Exception:
+            self.handleError(batch[-1])
+
+    # Write the queued records and stop the writer thread
+    def close(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            try:
+                self._queue.put(None, timeout=self.flush_interval)
+                thread.join(self.flush_interval * 5)
+            except queue.Full:
+                pass
+        logging.Handler.close(self)
+
+
+# Send the records of every logger to a `BackgroundHandler` writing JSON
+# lines to `filename`, or to standard error. The fields returned by
+# `context` are added to every record, and the records of the routes of
+# `sample_rates` are sampled. The queued records are written when the
+# logging module shuts down, at exit. Returns the handler.
+def setup_logging(filename=None, level=logging.INFO, context=None, sample_rates=None,
+                  max_queue=10000, batch_size=512, flush_interval=1.0):
+    stream = open(filename, 'a', encoding='utf-8') if filename else sys.stderr
+    handler = BackgroundHandler(stream, max_queue=max_queue, batch_size=batch_size,
+                                flush_interval=flush_interval)
+    handler.setFormatter(JsonFormatter())
+    if context is not None:
+        handler.addFilter(ContextFilter(context))
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
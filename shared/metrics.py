@@ -0,0 +1,239 @@
+import bisect
+import math
+import threading
+import weakref
+
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Format a sample value the way Prometheus expects it
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '%d' % value
+    return repr(value)
+
+
+# Escape a label value
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+# Format the `{name="value",...}` part of a sample
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ['%s="%s"' % (name, escape_label(value)) for name, value in zip(names, values)]
+    return '{%s}' % ','.join(pairs)
+
+
+# Object kept in the thread-local data of a thread owning a shard; it is
+# dropped with that data when the thread ends
+class _ShardOwner:
+    pass
+
+
+# Base class of the metrics.
+# Updates are recorded in a shard owned by the calling thread, so the hot
+# path never takes a lock; the shards are only summed up when the metrics
+# are scraped. When a thread ends, its shard is folded into the totals of
+# the finished threads, so counters never go back and short-lived threads,
+# e.g. one per request, do not pile up shards.
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = {}
+        self._retired = {}
+        self._shards_lock = threading.RLock()
+        self._local = threading.local()
+
+    # Get the shard of the calling thread
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            owner = self._local.owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards[id(shard)] = shard
+            weakref.finalize(owner, self._retire, shard).atexit = False
+            return shard
+
+    # Fold the shard of a finished thread into the retired totals
+    def _retire(self, shard):
+        with self._shards_lock:
+            self._shards.pop(id(shard), None)
+            for labelvalues, value in shard.items():
+                self._retired[labelvalues] = self._merge(self._retired.get(labelvalues), value)
+
+    # Add two values of a shard; values are replaced, never updated in place
+    def _merge(self, total, value):
+        return value if total is None else total + value
+
+    def _snapshots(self):
+        with self._shards_lock:
+            shards = list(self._shards.values())
+            retired = dict(self._retired)
+        return [dict(shard) for shard in shards] + [retired]
+
+    def samples(self):
+        raise NotImplementedError
+
+    # Samples of a metric read from `function` on every scrape.
+    # The function returns the value, or a mapping of label values to values.
+    def _function_samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labelvalues in sorted(values):
+            yield '', self.labelnames, labelvalues, values[labelvalues]
+
+    # Samples of a metric whose shards map label values to numbers
+    def _summed_samples(self):
+        totals = {}
+        for snapshot in self._snapshots():
+            for labelvalues, value in snapshot.items():
+                totals[labelvalues] = totals.get(labelvalues, 0) + value
+        for labelvalues in sorted(totals):
+            yield '', self.labelnames, labelvalues, totals[labelvalues]
+
+    # Render the metric in the text exposition format
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        for suffix, names, values, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix,
+                                        format_labels(names, values),
+                                        format_value(value)))
+        return '\n'.join(lines)
+
+
+# A value that only goes up, e.g. the number of requests served.
+# Counters built with a `function` are read from it on every scrape,
+# for values already counted elsewhere.
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.function = function
+
+    def inc(self, labelvalues=(), amount=1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def samples(self):
+        if self.function is not None:
+            return self._function_samples()
+        return self._summed_samples()
+
+
+# A value that goes up and down, e.g. the number of requests in flight.
+# Gauges built with a `function` are read from it on every scrape.
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.function = function
+
+    def inc(self, labelvalues=(), amount=1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def dec(self, labelvalues=(), amount=1):
+        self.inc(labelvalues, -amount)
+
+    # Current value of the gauge, summed over the threads
+    def value(self, labelvalues=()):
+        if self.function is not None:
+            values = self.function()
+            return values.get(labelvalues, 0) if isinstance(values, dict) else values
+        return sum(snapshot.get(labelvalues, 0) for snapshot in self._snapshots())
+
+    def samples(self):
+        if self.function is not None:
+            return self._function_samples()
+        return self._summed_samples()
+
+
+# Counts observations, e.g. request latencies, in cumulative buckets
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _merge(self, total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    # Each shard maps label values to the per-bucket counts,
+    # followed by the sum and the count of the observations
+    def observe(self, value, labelvalues=()):
+        shard = self._shard()
+        counts = shard.get(labelvalues)
+        if counts is None:
+            counts = shard[labelvalues] = [0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def samples(self):
+        totals = {}
+        for snapshot in self._snapshots():
+            for labelvalues, counts in snapshot.items():
+                counts = list(counts)
+                total = totals.get(labelvalues)
+                if total is None:
+                    totals[labelvalues] = counts
+                else:
+                    for i, count in enumerate(counts):
+                        total[i] += count
+        names = self.labelnames + ('le',)
+        for labelvalues in sorted(totals):
+            counts = totals[labelvalues]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield '_bucket', names, labelvalues + (format_value(bound),), cumulative
+            yield '_sum', self.labelnames, labelvalues, counts[-2]
+            yield '_count', self.labelnames, labelvalues, counts[-1]
+
+
+# A collection of metrics rendered together on a scrape
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self.register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    # Render every metric in the text exposition format
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
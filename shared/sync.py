@@ -0,0 +1,56 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# Shared modules, and the folders of the applications importing them
+MODULES = ('health.py', 'logs.py', 'metrics.py')
+TARGETS = (os.path.join('project', 'techtrends'), os.path.join('solutions', 'python-helloworld'))
+
+HEADER = ('# Generated from shared/%s by shared/sync.py: edit the original,\n'
+          '# then run `python shared/sync.py`.\n\n')
+
+
+# Content of the copy of the shared module `name`
+def generate(name):
+    with open(os.path.join(HERE, name)) as f:
+        return HEADER % name + f.read()
+
+
+# Paths of the copies, relative to the root of the repository, with their
+# expected content
+def copies():
+    for target in TARGETS:
+        for name in MODULES:
+            yield os.path.join(target, name), generate(name)
+
+
+# Paths of the copies missing or differing from their shared module
+def outdated():
+    paths = []
+    for path, content in copies():
+        try:
+            with open(os.path.join(ROOT, path)) as f:
+                current = f.read()
+        except FileNotFoundError:
+            current = None
+        if current != content:
+            paths.append(path)
+    return paths
+
+
+# Write the copies of the shared modules into the folder of each application,
+# so that each folder runs, and builds into an image, on its own.
+# With `--check`, only list the outdated copies, and exit with status 1 if any.
+if __name__ == "__main__":
+    paths = outdated()
+    if '--check' in sys.argv[1:]:
+        for path in paths:
+            print('outdated: %s' % path)
+        sys.exit(1 if paths else 0)
+    contents = dict(copies())
+    for path in paths:
+        with open(os.path.join(ROOT, path), 'w') as f:
+            f.write(contents[path])
+        print(path)
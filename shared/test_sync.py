@@ -0,0 +1,13 @@
+import os
+
+import sync
+
+
+def test_copies_of_the_shared_modules_are_up_to_date():
+    assert sync.outdated() == []
+
+
+def test_copies_name_their_original():
+    for path, content in sync.copies():
+        name = os.path.basename(path)
+        assert content.startswith('# Generated from shared/%s by shared/sync.py' % name)
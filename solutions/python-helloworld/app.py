@@ -1,13 +1,88 @@
-from flask import Flask
+from flask import Flask, Response, g, has_request_context, request
 from flask import json
 import logging
+import os
+import time
+
+from health import LagMonitor
+from logs import setup_logging
+from metrics import CONTENT_TYPE, Registry
 
 app = Flask(__name__)
+app.config['MAX_IN_FLIGHT'] = int(os.environ.get('HELLOWORLD_MAX_IN_FLIGHT', '64'))
+app.config['MAX_LAG_MS'] = float(os.environ.get('HELLOWORLD_MAX_LAG_MS', '500'))
+
+## only a sample of the frequent probe and scrape requests is logged
+LOG_SAMPLE_RATES = {'/status': 0.01, '/healthz': 0.01, '/metrics': 0.01}
+
+## fields of the current request added to every log record
+def log_context():
+    if not has_request_context():
+        return None
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    return {'method': request.method, 'route': route}
+
+## metrics exposed on the `/metrics` endpoint
+registry = Registry()
+request_count = registry.counter(
+    'helloworld_requests_total', 'Number of HTTP requests served.',
+    ('method', 'route', 'status'))
+request_latency = registry.histogram(
+    'helloworld_request_duration_seconds', 'Time spent handling HTTP requests.',
+    ('method', 'route'))
+requests_in_flight = registry.gauge(
+    'helloworld_requests_in_flight', 'Number of HTTP requests being handled.')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    requests_in_flight.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_latency.observe(time.perf_counter() - start, (request.method, route))
+        request_count.inc((request.method, route, str(response.status_code)))
+    return response
+
+@app.teardown_request
+def stop_request_timer(exception):
+    if g.pop('request_start', None) is not None:
+        requests_in_flight.dec()
+
+## lag of the worker threads, measured once the status is requested
+worker_lag = LagMonitor()
+
+@app.route('/healthz')
+def liveness():
+    response = app.response_class(
+            response=json.dumps({"result":"OK - healthy"}),
+            status=200,
+            mimetype='application/json'
+    )
+    return response
 
+## unhealthy when overloaded, so that no new request is routed to the app
 @app.route('/status')
 def healthcheck():
+    worker_lag.start()
+    ## the status request itself is in flight
+    in_flight = requests_in_flight.value() - 1
+    lag_ms = worker_lag.lag() * 1000
+    checks = {"in_flight": in_flight, "lag_ms": round(lag_ms, 3)}
+    if in_flight >= app.config['MAX_IN_FLIGHT'] or lag_ms >= app.config['MAX_LAG_MS']:
+        response = app.response_class(
+                response=json.dumps({"result":"ERROR - overloaded", "checks": checks}),
+                status=503,
+                mimetype='application/json'
+        )
+        app.logger.warning('Status request: overloaded')
+        return response
+
     response = app.response_class(
-            response=json.dumps({"result":"OK - healthy"}),
+            response=json.dumps({"result":"OK - healthy", "checks": checks}),
             status=200,
             mimetype='application/json'
     )
@@ -17,11 +92,7 @@ def healthcheck():
 
 @app.route('/metrics')
 def metrics():
-    response = app.response_class(
-            response=json.dumps({"status":"success","code":0,"data":{"UserCount":140,"UserCountActive":23}}),
-            status=200,
-            mimetype='application/json'
-    )
+    response = Response(registry.render(), content_type=CONTENT_TYPE)
 
     app.logger.info('Metrics request successfull')
     return response
@@ -33,7 +104,8 @@ def hello():
     return "Hello World!"
 
 if __name__ == "__main__":
-    ## stream logs to a file
-    logging.basicConfig(filename='app.log',level=logging.DEBUG)
+    ## stream logs to a file, as JSON lines written by a background thread
+    setup_logging(filename='app.log', level=logging.DEBUG, context=log_context,
+                  sample_rates=LOG_SAMPLE_RATES)
     
     app.run(host='0.0.0.0')
@@ -0,0 +1,51 @@
+# Generated from shared/health.py by shared/sync.py: edit the original,
+# then run `python shared/sync.py`.
+
+import asyncio
+import collections
+import threading
+import time
+
+
+# Measures how late a periodic timer fires, i.e. how long a ready thread
+# waits to run (GIL contention, CPU throttling) or how long an event loop
+# is blocked between two callbacks. The largest lag over the last `window`
+# measures, taken every `interval` seconds, is reported.
+class LagMonitor:
+    def __init__(self, interval=0.1, window=50):
+        self.interval = interval
+        self._lags = collections.deque(maxlen=window)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def record(self, lag):
+        self._lags.append(max(0.0, lag))
+
+    # Largest recent lag, in seconds
+    def lag(self):
+        return max(self._lags, default=0.0)
+
+    # Measure the lag of a background thread.
+    # Threads do not survive a fork, so the thread is started again when
+    # called from a forked process.
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._lags.clear()
+            self._thread = threading.Thread(target=self._run, name='lag-monitor', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            start = time.monotonic()
+            time.sleep(self.interval)
+            self.record(time.monotonic() - start - self.interval)
+
+    # Measure the lag of the running event loop, until cancelled
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(loop.time() - start - self.interval)